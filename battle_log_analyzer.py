@@ -0,0 +1,292 @@
+"""Per-battle statistics from battle_monitor.log, streamed with constant memory per file.
+
+python battle_log_analyzer.py battle_monitor.log --format csv > battles.csv
+"""
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from battle_monitor import RecordAssembler, LogRecord
+
+STATE_BLOCK = re.compile(r"Battle state detection result: (\w+) \(speed: ([\d.]+)x")
+BATTLE_FIELDS = [
+    "source", "client", "start", "end", "duration", "animation_time", "planning_time",
+    "other_time", "rounds", "animation_speed", "normal_speed", "time_saved", "complete",
+]
+
+def rotated_chain(path: Path) -> List[Path]:
+    """The log and its rotations, oldest first: name.N(.gz) ... name.1(.gz), name(.gz)"""
+    rotations = []
+    if not path.parent.is_dir():
+        return []
+    pattern = re.compile(re.escape(path.name) + r"\.(\d+)(\.gz)?$")
+    for sibling in path.parent.iterdir():
+        match = pattern.match(sibling.name)
+        if match:
+            rotations.append((int(match.group(1)), sibling))
+    chain = [sibling for _, sibling in sorted(rotations, reverse=True)]
+    if path.exists():
+        chain.append(path)
+    return chain
+
+def open_log(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+def read_records(paths: List[Path]) -> Iterator[LogRecord]:
+    for path in paths:
+        assembler = RecordAssembler()
+        with open_log(path) as f:
+            for line in f:
+                yield from assembler.feed(line)
+        yield from assembler.flush()
+
+def _timestamp(record: LogRecord) -> Optional[datetime.datetime]:
+    if not record.timestamp:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(record.timestamp)
+    except ValueError:
+        return None
+
+class _Battle:
+    __slots__ = ("client", "start", "times", "rounds", "animation_speed", "normal_speed")
+
+    def __init__(self, client: str, start: datetime.datetime, animation_speed, normal_speed):
+        self.client = client
+        self.start = start
+        self.times = {"playing_animation": 0.0, "planning": 0.0, "other": 0.0}
+        self.rounds = 0
+        self.animation_speed = animation_speed
+        self.normal_speed = normal_speed
+
+class BattleReconstructor:
+    """Rebuilds battles from the Battle began!/ended! markers and the state blocks in between"""
+    def __init__(self, source: str):
+        self.source = source
+        self._battles: Dict[str, _Battle] = {}
+        self._state: Dict[str, tuple] = {}
+        self._speeds: Dict[str, list] = {}
+
+    def _advance(self, client: str, now: datetime.datetime):
+        """Charge the time since the client's last state record to that state"""
+        state, since = self._state.get(client, (None, None))
+        battle = self._battles.get(client)
+        if battle is not None and since is not None and now >= since:
+            bucket = state if state in battle.times else "other"
+            battle.times[bucket] += (now - since).total_seconds()
+        self._state[client] = (state, now)
+
+    def _finish(self, battle: _Battle, end: datetime.datetime, complete: bool) -> dict:
+        duration = (end - battle.start).total_seconds()
+        animation = battle.times["playing_animation"]
+        saved = 0.0
+        if battle.animation_speed and battle.normal_speed:
+            # Animations ran at animation_speed; at normal speed they'd have taken this much longer
+            saved = animation * (battle.animation_speed / battle.normal_speed - 1)
+        return {
+            "source": self.source,
+            "client": battle.client,
+            "start": battle.start.isoformat(sep=" "),
+            "end": end.isoformat(sep=" "),
+            "duration": round(duration, 3),
+            "animation_time": round(animation, 3),
+            "planning_time": round(battle.times["planning"], 3),
+            "other_time": round(battle.times["other"], 3),
+            "rounds": battle.rounds,
+            "animation_speed": battle.animation_speed,
+            "normal_speed": battle.normal_speed,
+            "time_saved": round(saved, 3),
+            "complete": complete,
+        }
+
+    def feed(self, record: LogRecord) -> Iterator[dict]:
+        now = _timestamp(record)
+        if now is None:
+            return
+        client = record.client or "Client ?"
+        text = record.text
+        if "Battle began!" in text:
+            self._advance(client, now)
+            previous = self._battles.pop(client, None)
+            if previous is not None:
+                yield self._finish(previous, now, complete=False)
+            speeds = self._speeds.get(client, [None, None])
+            self._battles[client] = _Battle(client, now, speeds[0], speeds[1])
+            state = self._state.get(client, (None, None))[0]
+            if state == "playing_animation":
+                self._battles[client].rounds += 1
+            return
+        if "Battle ended!" in text:
+            self._advance(client, now)
+            self._state[client] = ("not_in_battle", now)
+            battle = self._battles.pop(client, None)
+            if battle is not None:
+                yield self._finish(battle, now, complete=True)
+            return
+        match = STATE_BLOCK.search(text)
+        if match:
+            self._advance(client, now)
+            state, speed = match.group(1), float(match.group(2))
+            previous_state = self._state[client][0]
+            self._state[client] = (state, now)
+            speeds = self._speeds.setdefault(client, [None, None])
+            if state == "playing_animation":
+                speeds[0] = speed
+            else:
+                speeds[1] = speed
+            battle = self._battles.get(client)
+            if battle is not None:
+                if state == "playing_animation":
+                    battle.animation_speed = speed
+                    if previous_state != "playing_animation":
+                        battle.rounds += 1
+                elif state != "not_in_battle":
+                    battle.normal_speed = speed
+
+    def close(self) -> Iterator[dict]:
+        """Battles still open when the log ends, marked incomplete"""
+        for client, battle in list(self._battles.items()):
+            end = self._state.get(client, (None, battle.start))[1] or battle.start
+            yield self._finish(battle, end, complete=False)
+        self._battles.clear()
+
+class Summary:
+    """Running aggregates, constant memory regardless of the number of battles"""
+    def __init__(self):
+        self.battles = 0
+        self.complete = 0
+        self.duration = 0.0
+        self.animation_time = 0.0
+        self.planning_time = 0.0
+        self.time_saved = 0.0
+        self.rounds = 0
+        self.longest = 0.0
+        self.shortest = None
+
+    def add(self, battle: dict):
+        self.battles += 1
+        self.complete += battle["complete"]
+        self.duration += battle["duration"]
+        self.animation_time += battle["animation_time"]
+        self.planning_time += battle["planning_time"]
+        self.time_saved += battle["time_saved"]
+        self.rounds += battle["rounds"]
+        self.longest = max(self.longest, battle["duration"])
+        self.shortest = battle["duration"] if self.shortest is None else min(self.shortest, battle["duration"])
+
+    def merge(self, other: "Summary"):
+        for name in ("battles", "complete", "duration", "animation_time", "planning_time", "time_saved", "rounds"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.longest = max(self.longest, other.longest)
+        if other.shortest is not None:
+            self.shortest = other.shortest if self.shortest is None else min(self.shortest, other.shortest)
+
+    def as_dict(self) -> dict:
+        return {
+            "battles": self.battles,
+            "complete_battles": self.complete,
+            "total_battle_time": round(self.duration, 3),
+            "mean_battle_time": round(self.duration / self.battles, 3) if self.battles else 0.0,
+            "shortest_battle": self.shortest,
+            "longest_battle": self.longest,
+            "mean_rounds": round(self.rounds / self.battles, 2) if self.battles else 0.0,
+            "animation_fraction": round(self.animation_time / self.duration, 4) if self.duration else 0.0,
+            "planning_fraction": round(self.planning_time / self.duration, 4) if self.duration else 0.0,
+            "total_time_saved": round(self.time_saved, 3),
+        }
+
+def iter_battles(chain: List[Path], summary: Summary) -> Iterator[dict]:
+    """Battles in one log and its rotations, read oldest first"""
+    reconstructor = BattleReconstructor(chain[-1].name)
+    for record in read_records(chain):
+        for battle in reconstructor.feed(record):
+            summary.add(battle)
+            yield battle
+    for battle in reconstructor.close():
+        summary.add(battle)
+        yield battle
+
+def analyze_chain(paths: List[str]) -> tuple:
+    """Worker entry point. Battles are spooled to a temp file as JSON lines so
+    neither the worker nor the parent holds them in memory; returns (spool, summary)"""
+    summary = Summary()
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as spool:
+        for battle in iter_battles([Path(path) for path in paths], summary):
+            spool.write(json.dumps(battle) + "\n")
+    return spool.name, summary
+
+def _chains(paths: List[str], follow_rotation: bool) -> List[List[str]]:
+    chains = []
+    for name in paths:
+        path = Path(name)
+        if follow_rotation:
+            chain = rotated_chain(path)
+        else:
+            chain = [path] if path.is_file() else []
+        if chain:
+            chains.append([str(member) for member in chain])
+        else:
+            print(f"Skipping {name}: not found", file=sys.stderr)
+    return chains
+
+def main(options):
+    chains = _chains(options.logs, not options.no_rotation)
+    total = Summary()
+    writer = None
+    if options.format == "csv" and not options.summary_only:
+        writer = csv.DictWriter(sys.stdout, fieldnames=BATTLE_FIELDS)
+        writer.writeheader()
+
+    workers = min(len(chains), options.jobs or os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for spool, summary in pool.map(analyze_chain, chains):
+                try:
+                    with open(spool, "r", encoding="utf-8") as f:
+                        _emit((json.loads(line) for line in f), writer, options)
+                finally:
+                    os.remove(spool)
+                total.merge(summary)
+    else:
+        for chain in chains:
+            _emit(iter_battles([Path(path) for path in chain], total), writer, options)
+
+    if options.format == "json":
+        print(json.dumps({"summary": total.as_dict()}))
+    else:
+        if writer is not None:
+            sys.stdout.write("\n")
+        summary_writer = csv.writer(sys.stdout)
+        for key, value in total.as_dict().items():
+            summary_writer.writerow([key, value])
+
+def _emit(battles: Iterator[dict], writer, options):
+    for battle in battles:
+        if options.summary_only:
+            continue
+        if writer is not None:
+            writer.writerow(battle)
+        else:
+            print(json.dumps(battle))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Battle statistics from battle monitor logs")
+    parser.add_argument("logs", nargs="*", default=["battle_monitor.log"],
+                        help="log files, plain or .gz; rotations (name.1, name.2.gz, ...) are picked up")
+    parser.add_argument("--format", choices=("csv", "json"), default="csv",
+                        help="csv: battle rows then summary rows; json: one battle per line then the summary")
+    parser.add_argument("--summary-only", action="store_true", help="only print the aggregate statistics")
+    parser.add_argument("--no-rotation", action="store_true", help="don't pick up rotated siblings of each log")
+    parser.add_argument("--jobs", type=int, default=0, help="worker processes, defaults to one per CPU")
+    main(parser.parse_args())
@@ -1,30 +1,275 @@
 import time
 import os
-import tempfile
-import atexit
+import re
+import sys
+import json
+import select
+import argparse
+import socket
+from collections import namedtuple
 
-lock_path = os.path.join(tempfile.gettempdir(), "wizwalker_battle_monitor.lock")
-def remove_lock():
-    if os.path.exists(lock_path):
+DEFAULT_ADDRESS = "127.0.0.1:47321"
+
+RECORD_START = re.compile(r"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] (?:\[(Client [^\]]+)\] )?")
+STATE_LINE = re.compile(r"Battle state detection result: (\w+)")
+EVENT_MARKERS = ("Battle began!", "Battle ended!", "Set speed to", "Speed drifted", "Monitor error", "Monitor crashed")
+
+# One reassembled log entry; text keeps the continuation lines of multi-line blocks
+LogRecord = namedtuple("LogRecord", "timestamp client text")
+
+def parse_record(raw: str) -> LogRecord:
+    if raw.startswith("{"):
+        try:
+            data = json.loads(raw)
+            return LogRecord(data.get("ts"), data.get("client"), f"[{data.get('ts')}] {data.get('msg', '')}\n")
+        except ValueError:
+            pass
+    match = RECORD_START.match(raw)
+    if not match:
+        return LogRecord(None, None, raw)
+    return LogRecord(match.group(1), match.group(2), raw)
+
+class RecordAssembler:
+    """Groups timestamped lines and their continuation lines into records"""
+    def __init__(self):
+        self._lines = []
+
+    def feed(self, line: str):
+        """Yield every record completed by this line"""
+        starts_record = line.startswith("{") or RECORD_START.match(line)
+        if starts_record and self._lines:
+            yield parse_record("".join(self._lines))
+            self._lines = []
+        self._lines.append(line)
+
+    def flush(self):
+        if self._lines:
+            yield parse_record("".join(self._lines))
+            self._lines = []
+
+class TransitionFilter:
+    """Passes event records and state blocks whose state differs from the client's last one"""
+    def __init__(self):
+        self._states = {}
+
+    def __call__(self, record: LogRecord) -> bool:
+        if any(marker in record.text for marker in EVENT_MARKERS):
+            return True
+        match = STATE_LINE.search(record.text)
+        if not match:
+            return False
+        previous = self._states.get(record.client)
+        self._states[record.client] = match.group(1)
+        return previous != match.group(1)
+
+class _Inotify:
+    """Minimal inotify binding through ctypes, watching the log's directory"""
+    IN_MODIFY = 0x002
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0x800
+    IN_CLOEXEC = 0x80000
+
+    def __init__(self, directory: str):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_MODIFY | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, timeout: float):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
         try:
-            os.remove(lock_path)
-        except Exception:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
             pass
-atexit.register(remove_lock)
 
-def tail_log(filename):
+    def activity(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+class _AdaptivePoller:
+    """Sleeps briefly right after activity and backs off while the log is idle"""
+    def __init__(self, floor: float = 0.05, ceiling: float = 1.0):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.interval = floor
+
+    def wait(self, timeout: float):
+        time.sleep(min(self.interval, timeout))
+        self.interval = min(self.interval * 2, self.ceiling)
+
+    def activity(self):
+        self.interval = self.floor
+
+    def close(self):
+        pass
+
+def _make_waiter(filename: str):
+    if sys.platform.startswith("linux"):
+        try:
+            return _Inotify(os.path.dirname(os.path.abspath(filename)))
+        except (OSError, AttributeError):
+            pass
+    return _AdaptivePoller()
+
+def follow_records(filename: str, idle_flush: float = 0.5):
+    """Yield LogRecords appended to filename, surviving rotation and truncation"""
+    waiter = _make_waiter(filename)
+    assembler = RecordAssembler()
+    f = open(filename, "r", encoding="utf-8")
+    f.seek(0, os.SEEK_END)
+    last_data = time.monotonic()
+    try:
+        while True:
+            while True:
+                pos = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith("\n"):
+                    # Partial write, re-read it once the rest arrives
+                    f.seek(pos)
+                    break
+                last_data = time.monotonic()
+                waiter.activity()
+                yield from assembler.feed(line)
+
+            try:
+                current = os.stat(filename)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(f.fileno())
+            if current is not None and (current.st_ino != opened.st_ino or current.st_dev != opened.st_dev):
+                # Rotated: finish the old file, then start the new one from the top
+                for line in iter(f.readline, ""):
+                    yield from assembler.feed(line)
+                yield from assembler.flush()
+                f.close()
+                f = open(filename, "r", encoding="utf-8")
+                continue
+            if current is not None and current.st_size < f.tell():
+                yield from assembler.flush()
+                f.seek(0)
+                continue
+
+            waiter.wait(idle_flush)
+            if time.monotonic() - last_data >= idle_flush:
+                # Quiet period, the last multi-line block is complete
+                yield from assembler.flush()
+    finally:
+        f.close()
+        waiter.close()
+
+def tail_log(filename, only_transitions: bool = False, client: str = None, pattern: str = None):
     print("Battle Monitor Log Viewer")
     print(f"Watching: {filename}\n")
     if not os.path.exists(filename):
         open(filename, "w").close()
-    with open(filename, "r", encoding="utf-8") as f:
-        f.seek(0, os.SEEK_END)
-        while True:
-            line = f.readline()
-            if not line:
-                time.sleep(0.2)
-                continue
-            print(line, end="", flush=True)
+    transitions = TransitionFilter() if only_transitions else None
+    regex = re.compile(pattern) if pattern else None
+    for record in follow_records(filename):
+        if client and record.client != f"Client {client}":
+            continue
+        if regex and not regex.search(record.text):
+            continue
+        if transitions and not transitions(record):
+            continue
+        text = record.text
+        print(text if text.endswith("\n") else text + "\n", end="", flush=True)
+
+def connect(address: str) -> socket.socket:
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return socket.create_connection((host, int(port)))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(address)
+    return sock
+
+def format_event(event: dict) -> str:
+    stamp = (event.get("ts") or "")[11:19]
+    client = f"[{event['client']}] " if event.get("client") else ""
+    kind = event.get("event")
+    if kind == "state":
+        after = f", after {event['dwell']}s in {event['previous']}" if event.get("previous") else ""
+        return f"[{stamp}] {client}State: {event.get('state')} (speed: {event.get('speed')}x{after})"
+    if kind == "dropped":
+        return f"[{stamp}] ... {event.get('count')} events dropped, viewer fell behind"
+    msg = event.get("msg", "")
+    # Event messages already carry their [Client N] prefix
+    return f"[{stamp}] {msg}" if msg else f"[{stamp}] {client}{kind}"
+
+def subscribe(address: str, events=None, retry: float = 2.0):
+    """Yield events from the walker's event stream, reconnecting while it's down"""
+    waiting = False
+    while True:
+        try:
+            sock = connect(address)
+        except OSError:
+            if not waiting:
+                print(f"Waiting for the walker on {address}...", flush=True)
+                waiting = True
+            time.sleep(retry)
+            continue
+        waiting = False
+        with sock, sock.makefile("r", encoding="utf-8") as stream:
+            if events:
+                sock.sendall((json.dumps({"events": events}) + "\n").encode())
+            try:
+                for line in stream:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+            except OSError:
+                pass
+        print("Event stream closed", flush=True)
+
+def watch_events(address: str, client: str = None, events=None, pattern: str = None, raw: bool = False):
+    print("Battle Monitor")
+    print(f"Subscribed to: {address}\n")
+    regex = re.compile(pattern) if pattern else None
+    for event in subscribe(address, events):
+        if event.get("event") == "hello":
+            for state in event.get("states", []):
+                if not client or state.get("client") == f"Client {client}":
+                    print(format_event({"event": "state", "ts": event.get("ts"), **state}), flush=True)
+            continue
+        if client and event.get("client") not in (None, f"Client {client}"):
+            continue
+        text = json.dumps(event) if raw else format_event(event)
+        if regex and not regex.search(text):
+            continue
+        print(text, flush=True)
 
 if __name__ == "__main__":
-    tail_log("battle_monitor.log")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Watch battle events from a running walker")
+    parser.add_argument("--connect", default=DEFAULT_ADDRESS,
+                        help="host:port or Unix socket path of the walker's event stream")
+    parser.add_argument("--events", help="comma separated event types, e.g. state,speed,battle_began")
+    parser.add_argument("--client", help="only show events for this client number")
+    parser.add_argument("--grep", help="only show events matching this regex")
+    parser.add_argument("--json", action="store_true", help="print raw event JSON")
+    parser.add_argument("--log", metavar="FILE", help="follow a battle log file instead of the event stream")
+    parser.add_argument("--transitions", action="store_true", help="with --log, only show state changes and battle events")
+    options = parser.parse_args()
+    try:
+        if options.log:
+            tail_log(options.log, options.transitions, options.client, options.grep)
+        else:
+            events = options.events.split(",") if options.events else None
+            watch_events(options.connect, options.client, events, options.grep, options.json)
+    except KeyboardInterrupt:
+        pass
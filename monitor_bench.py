@@ -0,0 +1,342 @@
+"""Simulated Wizard101 clients and a benchmark for the battle monitor loop.
+
+Run without a game: python monitor_bench.py --clients 1,2,4,8 --duration 10
+"""
+import asyncio
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from collections import namedtuple
+from typing import Callable, List, Optional, Union
+
+from wizwalker import XYZ
+
+import wizard_interactive
+from wizard_interactive import EnhancedWizWalker, BattleLogger
+
+# One scripted stretch of a client's timeline
+Segment = namedtuple("Segment", "duration in_battle phase")
+
+class SimDuelPhase:
+    """Stand-in for wizwalker's DuelPhase enum members, only .name is used"""
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f"DuelPhase.{self.name}"
+
+def default_timeline(rounds: int = 3, idle: float = 2.0, planning: float = 1.5, execution: float = 1.2) -> List[Segment]:
+    timeline = [Segment(idle, False, "ended"), Segment(0.2, True, "starting")]
+    for _ in range(rounds):
+        timeline += [
+            Segment(planning, True, "planning"),
+            Segment(0.1, True, "pre_execution"),
+            Segment(execution, True, "execution"),
+            Segment(0.1, True, "resolution"),
+        ]
+    timeline.append(Segment(0.2, True, "ended"))
+    return timeline
+
+class SimTimeline:
+    """Plays a list of segments in a loop starting from a given time"""
+    def __init__(self, segments: List[Segment], start: Optional[float] = None):
+        self.segments = segments
+        self.period = sum(segment.duration for segment in segments)
+        self.start = time.monotonic() if start is None else start
+
+    def at(self, now: Optional[float] = None) -> Segment:
+        offset = ((time.monotonic() if now is None else now) - self.start) % self.period
+        for segment in self.segments:
+            if offset < segment.duration:
+                return segment
+            offset -= segment.duration
+        return self.segments[-1]
+
+    def transitions(self, since: float, until: float) -> List[tuple]:
+        """(time, battle_state) for every point in [since, until) where the monitor should change speed"""
+        result = []
+        previous = None
+        cycle_start = self.start - self.period * ((self.start - since) // self.period + 1)
+        while cycle_start < until:
+            t = cycle_start
+            for segment in self.segments:
+                state = sim_battle_state(segment)
+                if state is not None:
+                    if state != previous and since <= t < until:
+                        result.append((t, state))
+                    previous = state
+                t += segment.duration
+            cycle_start += self.period
+        return result
+
+def sim_battle_state(segment: Segment) -> Optional[str]:
+    if not segment.in_battle:
+        return "not_in_battle"
+    if segment.phase == "execution":
+        return "playing_animation"
+    if segment.phase == "planning":
+        return "planning"
+    return None
+
+class SimCounters:
+    def __init__(self):
+        self.reads = 0
+        self.walks = 0
+        self.ticks = 0
+        self.writes = []
+
+class _SimPart:
+    def __init__(self, client: "SimClient"):
+        self.client = client
+
+class SimWindow(_SimPart):
+    def __init__(self, client: "SimClient", name: str, parent):
+        super().__init__(client)
+        self._name = name
+        self._parent = parent
+
+    async def name(self) -> str:
+        await self.client._read()
+        return self._name
+
+    async def parent(self):
+        await self.client._read()
+        return self._parent
+
+class SimRootWindow(_SimPart):
+    async def get_windows_with_name(self, name: str) -> list:
+        await self.client._read(self.client.walk_latency)
+        self.client.counters.walks += 1
+        segment = self.client.timeline.at()
+        if segment.in_battle and name == "CombatantControl":
+            return self.client._combat_windows
+        return []
+
+class SimDuel(_SimPart):
+    async def duel_phase(self) -> SimDuelPhase:
+        await self.client._read()
+        return SimDuelPhase(self.client.timeline.at().phase)
+
+class SimBody(_SimPart):
+    async def position(self) -> XYZ:
+        await self.client._read()
+        return self.client._position
+
+class SimClientObject(_SimPart):
+    async def write_speed_multiplier(self, value: int):
+        await self.client._read()
+        self.client._speed = value
+        self.client.counters.writes.append((time.monotonic(), value))
+
+    async def speed_multiplier(self) -> int:
+        await self.client._read()
+        return self.client._speed
+
+class SimClient:
+    """The subset of a wizwalker Client that EnhancedWizWalker touches, backed by a
+    scripted timeline and an injectable per-call latency"""
+    def __init__(self, timeline: SimTimeline, latency: Union[float, Callable[[], float]] = 0.0,
+                 walk_latency: Union[float, Callable[[], float], None] = None,
+                 zone: str = "WizardCity/WC_Hub", quest_objectives: Optional[List[XYZ]] = None):
+        self.timeline = timeline
+        self.latency = latency
+        self.walk_latency = latency if walk_latency is None else walk_latency
+        self.counters = SimCounters()
+        self._speed = 100
+        self._zone = zone
+        self._position = XYZ(0.0, 0.0, 0.0)
+        self._quest_objectives = quest_objectives or []
+        self.root_window = SimRootWindow(self)
+        self.duel = SimDuel(self)
+        self.body = SimBody(self)
+        self.client_object = SimClientObject(self)
+        self._combat_windows = [SimWindow(self, "CombatantControl", self.root_window) for _ in range(3)]
+
+    async def _read(self, latency=None):
+        latency = self.latency if latency is None else latency
+        delay = latency() if callable(latency) else latency
+        self.counters.reads += 1
+        await asyncio.sleep(delay)
+
+    async def in_battle(self) -> bool:
+        # Every monitor tick starts with this read, so it doubles as the tick counter
+        self.counters.ticks += 1
+        await self._read()
+        return self.timeline.at().in_battle
+
+    async def detect_battle_state(self) -> str:
+        await self._read()
+        await self._read(self.walk_latency)
+        state = sim_battle_state(self.timeline.at())
+        return state or "planning"
+
+    async def is_loading(self) -> bool:
+        await self._read()
+        return False
+
+    async def zone_name(self) -> str:
+        await self._read()
+        return self._zone
+
+    async def is_in_dialog(self) -> bool:
+        await self._read()
+        return False
+
+    async def is_in_npc_range(self) -> bool:
+        await self._read()
+        return False
+
+    async def quest_id(self) -> int:
+        await self._read()
+        return 1
+
+    async def goal_id(self) -> int:
+        await self._read()
+        return 1
+
+    async def get_quest_objectives(self) -> List[XYZ]:
+        await self._read()
+        return list(self._quest_objectives)
+
+    async def teleport(self, position: XYZ):
+        await self._read()
+        self._position = position
+
+    async def activate_hooks(self):
+        pass
+
+    async def close(self):
+        pass
+
+class SimWalker(EnhancedWizWalker):
+    """EnhancedWizWalker over simulated clients instead of running game processes"""
+    def __init__(self, sim_clients: List[SimClient], speed_multiplier: float = 1.0):
+        super().__init__(speed_multiplier)
+        self._sim_clients = sim_clients
+
+    def get_new_clients(self):
+        self.clients = list(self._sim_clients)
+        return self.clients
+
+    async def start_battle_monitor(self):
+        pass
+
+    async def stop_battle_monitor(self):
+        pass
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def _speed_latencies(client: SimClient, walker: EnhancedWizWalker, since: float, until: float) -> List[float]:
+    """Time from each scripted transition that changes the wanted speed to the first write of it"""
+    wanted = {
+        "not_in_battle": int(walker.speed_multiplier * 100),
+        "playing_animation": int(walker.battle_speed_multiplier * 100),
+        "planning": int(walker.speed_multiplier * 100),
+    }
+    latencies = []
+    writes = client.counters.writes
+    previous = None
+    for moment, state in client.timeline.transitions(since, until):
+        speed = wanted[state]
+        if previous is not None and speed != previous:
+            earlier = [value for written_at, value in writes if written_at < moment]
+            if earlier and earlier[-1] == speed:
+                # A transitional phase already led the monitor to the right speed
+                latencies.append(0.0)
+            else:
+                for written_at, value in writes:
+                    if written_at >= moment and value == speed:
+                        latencies.append(written_at - moment)
+                        break
+        previous = speed
+    return latencies
+
+async def run_benchmark(num_clients: int, duration: float, latency: float, walk_latency: float,
+                        jitter: float = 0.0, seed: int = 0, confirm_ticks: int = 2) -> dict:
+    rng = random.Random(seed)
+    def call_latency(base):
+        if not jitter:
+            return base
+        return lambda: max(0.0, base + rng.uniform(-jitter, jitter))
+
+    start = time.monotonic()
+    clients = [
+        # Stagger timelines so clients don't change phase in lockstep
+        SimClient(SimTimeline(default_timeline(), start - idx * 0.37), call_latency(latency), call_latency(walk_latency))
+        for idx in range(num_clients)
+    ]
+    walker = SimWalker(clients, 2.0)
+    walker.get_new_clients()
+    walker.set_state_debounce(confirm_ticks)
+    walker.fast_battles_enabled = True
+    walker._start_battle_monitors()
+    await asyncio.sleep(duration)
+    end = time.monotonic()
+    await walker._stop_battle_monitors()
+
+    ticks = sum(client.counters.ticks for client in clients)
+    reads = sum(client.counters.reads for client in clients)
+    latencies = []
+    for client in clients:
+        # Skip the first second while monitors spin up, and the last one whose writes may not have landed
+        latencies += _speed_latencies(client, walker, start + 1.0, end - 1.0)
+    p50 = _percentile(latencies, 0.5)
+    p99 = _percentile(latencies, 0.99)
+    return {
+        "clients": num_clients,
+        "ticks_per_second": ticks / (end - start),
+        "reads_per_tick": reads / ticks if ticks else 0.0,
+        "tree_walks": sum(client.counters.walks for client in clients),
+        "speed_writes": sum(len(client.counters.writes) for client in clients),
+        "transitions": len(latencies),
+        "p50_ms": p50 * 1000 if p50 is not None else None,
+        "p99_ms": p99 * 1000 if p99 is not None else None,
+    }
+
+def _format_row(result: dict) -> str:
+    def ms(value):
+        return f"{value:8.1f}" if value is not None else "       -"
+    return (
+        f"{result['clients']:>7} {result['ticks_per_second']:>9.1f} {result['reads_per_tick']:>10.2f} "
+        f"{result['tree_walks']:>6} {result['speed_writes']:>7} {ms(result['p50_ms'])} {ms(result['p99_ms'])}"
+    )
+
+async def main(options):
+    # Keep benchmark output out of the real battle log
+    log_path = os.path.join(tempfile.gettempdir(), "wizwalker_bench.log")
+    wizard_interactive.battle_logger = BattleLogger(log_path)
+    results = []
+    if not options.json:
+        print("clients  ticks/s  reads/tick  walks  writes  p50 ms   p99 ms")
+    for count in options.clients:
+        result = await run_benchmark(
+            count, options.duration, options.latency_ms / 1000,
+            options.walk_latency_ms / 1000, options.jitter_ms / 1000, options.seed, options.confirm_ticks
+        )
+        results.append(result)
+        if not options.json:
+            print(_format_row(result), flush=True)
+    await wizard_interactive.battle_logger.close()
+    if options.json:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the battle monitor against simulated clients")
+    parser.add_argument("--clients", default="1,2,4,8",
+                        type=lambda value: [int(part) for part in value.split(",")],
+                        help="comma separated client counts to run")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="latency of a plain memory read")
+    parser.add_argument("--walk-latency-ms", type=float, default=15.0, help="latency of a UI tree walk")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- jitter on every call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--confirm-ticks", type=int, default=2, help="reads needed to accept a battle state change")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    asyncio.run(main(parser.parse_args()))
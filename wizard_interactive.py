@@ -9,74 +9,1401 @@ import subprocess
 import sys
 import datetime
 import tempfile
+import heapq
+import array
+import sqlite3
+import atexit
+import collections
+import time
+import itertools
+import threading
+import contextvars
+import io
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+AREA_CELL_SIZE = 100
+
+def background_task(coro) -> asyncio.Task:
+    """create_task in a fresh context, for tasks that outlive whatever started them.
+    Otherwise they'd inherit per-command state such as an @ command's output buffer."""
+    return contextvars.Context().run(asyncio.get_running_loop().create_task, coro)
+
+class LandmarkGrid:
+    """Uniform grid over a zone's landmarks, using the same cells as the area keys"""
+    def __init__(self, landmarks: Optional[List[dict]] = None):
+        self.cells: Dict[tuple, List[dict]] = {}
+        self.count = 0
+        self.min_cx = self.max_cx = self.min_cy = self.max_cy = 0
+        for landmark in landmarks or []:
+            self.add(landmark)
+
+    @staticmethod
+    def cell_of(x: float, y: float) -> tuple:
+        return int(x // AREA_CELL_SIZE), int(y // AREA_CELL_SIZE)
+
+    def add(self, landmark: dict):
+        cx, cy = self.cell_of(landmark["x"], landmark["y"])
+        if self.count == 0:
+            self.min_cx = self.max_cx = cx
+            self.min_cy = self.max_cy = cy
+        else:
+            self.min_cx, self.max_cx = min(self.min_cx, cx), max(self.max_cx, cx)
+            self.min_cy, self.max_cy = min(self.min_cy, cy), max(self.max_cy, cy)
+        self.cells.setdefault((cx, cy), []).append(landmark)
+        self.count += 1
+
+    def remove(self, landmark: dict) -> bool:
+        key = self.cell_of(landmark["x"], landmark["y"])
+        bucket = self.cells.get(key)
+        if not bucket:
+            return False
+        for idx, entry in enumerate(bucket):
+            if entry is landmark:
+                del bucket[idx]
+                break
+        else:
+            return False
+        if not bucket:
+            del self.cells[key]
+        self.count -= 1
+        return True
+
+    def _ring(self, cx: int, cy: int, ring: int):
+        if ring == 0:
+            yield cx, cy
+            return
+        for dx in range(-ring, ring + 1):
+            yield cx + dx, cy - ring
+            yield cx + dx, cy + ring
+        for dy in range(-ring + 1, ring):
+            yield cx - ring, cy + dy
+            yield cx + ring, cy + dy
+
+    def within(self, x: float, y: float, radius: float) -> List[tuple]:
+        """(distance, landmark) pairs within radius, closest first"""
+        lo_x, lo_y = self.cell_of(x - radius, y - radius)
+        hi_x, hi_y = self.cell_of(x + radius, y + radius)
+        if (hi_x - lo_x + 1) * (hi_y - lo_y + 1) > len(self.cells):
+            keys = [k for k in self.cells if lo_x <= k[0] <= hi_x and lo_y <= k[1] <= hi_y]
+        else:
+            keys = [(i, j) for i in range(lo_x, hi_x + 1) for j in range(lo_y, hi_y + 1)]
+        found = []
+        for key in keys:
+            for landmark in self.cells.get(key, ()):
+                dist = math.hypot(x - landmark["x"], y - landmark["y"])
+                if dist <= radius:
+                    found.append((dist, landmark))
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+    def nearest(self, x: float, y: float, k: int = 1) -> List[tuple]:
+        """k closest (distance, landmark) pairs, expanding ring by ring from the query cell"""
+        if k <= 0 or self.count == 0:
+            return []
+        cx, cy = self.cell_of(x, y)
+        max_ring = max(cx - self.min_cx, self.max_cx - cx, cy - self.min_cy, self.max_cy - cy)
+        candidates = []
+        for ring in range(max_ring + 1):
+            if 8 * ring > len(self.cells):
+                # Rings are sparser than the occupied cells, finish with a plain scan
+                candidates = [
+                    (math.hypot(x - lm["x"], y - lm["y"]), lm)
+                    for bucket in self.cells.values() for lm in bucket
+                ]
+                break
+            for key in self._ring(cx, cy, ring):
+                for landmark in self.cells.get(key, ()):
+                    candidates.append((math.hypot(x - landmark["x"], y - landmark["y"]), landmark))
+            # Anything beyond this ring is at least ring * cell size away
+            if len(candidates) >= k:
+                kth = heapq.nsmallest(k, candidates, key=lambda pair: pair[0])[-1][0]
+                if kth <= ring * AREA_CELL_SIZE:
+                    break
+        return heapq.nsmallest(k, candidates, key=lambda pair: pair[0])
+
+class AreaCell:
+    """Bounds and visit count of one x//100, y//100 cell"""
+    __slots__ = ("min_x", "max_x", "min_y", "max_y", "visits", "name")
+
+    def __init__(self, min_x: float, max_x: float, min_y: float, max_y: float,
+                 visits: int = 0, name: Optional[str] = None):
+        self.min_x = min_x
+        self.max_x = max_x
+        self.min_y = min_y
+        self.max_y = max_y
+        self.visits = visits
+        self.name = name
+
+class ZoneData:
+    """One zone's areas and landmarks as held in memory, plus what still needs saving"""
+    __slots__ = ("name", "areas", "landmarks", "grid", "dirty_areas", "landmarks_dirty")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.areas: Dict[tuple, AreaCell] = {}
+        self.landmarks: List[dict] = []
+        self.grid: Optional[LandmarkGrid] = None
+        self.dirty_areas = set()
+        self.landmarks_dirty = False
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.dirty_areas) or self.landmarks_dirty
+
+class LocationStore:
+    """SQLite file holding every zone, read one zone at a time"""
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS zones (name TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS areas (
+            zone TEXT, cx INTEGER, cy INTEGER,
+            min_x REAL, max_x REAL, min_y REAL, max_y REAL,
+            visits INTEGER, name TEXT,
+            PRIMARY KEY (zone, cx, cy)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS landmarks (zone TEXT, name TEXT, x REAL, y REAL, z REAL);
+        CREATE INDEX IF NOT EXISTS landmarks_zone ON landmarks (zone);
+    """
+
+    def __init__(self, path: Path, legacy_json: Optional[Path] = None):
+        self.path = Path(path)
+        self.legacy_json = legacy_json
+        # Loads run on the loop thread and writes in an executor, each on its own
+        # connection; WAL lets a load read the last commit while a write is in progress
+        self._reader = None
+        self._writer = None
+        self._write_lock = threading.Lock()
+
+    def open(self):
+        """Create the schema and run the JSON migration, blocking so call it from an executor"""
+        with self._write_lock:
+            self._writer_connection()
+
+    def _writer_connection(self) -> sqlite3.Connection:
+        if self._writer is None:
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+            self._writer = conn
+            self._migrate_json()
+        return self._writer
+
+    def _reader_connection(self) -> sqlite3.Connection:
+        if self._reader is None:
+            if self._writer is None:
+                # Nobody opened the store ahead of time, do it now
+                self.open()
+            self._reader = sqlite3.connect(str(self.path), check_same_thread=False)
+        return self._reader
+
+    def _migrate_json(self):
+        """One-time import of the old location_data.json"""
+        conn = self._writer
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+            return
+        if self.legacy_json is not None and self.legacy_json.exists():
+            try:
+                locations = json.loads(self.legacy_json.read_text())
+            except ValueError:
+                locations = {}
+            batch = []
+            for zone, data in locations.items():
+                rows = []
+                for key, area in data.get("areas", {}).items():
+                    cx, cy = (int(part) for part in key.split(","))
+                    rows.append((zone, cx, cy, area["min_x"], area["max_x"], area["min_y"], area["max_y"],
+                                 area.get("visits", 0), area.get("name")))
+                landmarks = [(zone, lm["name"], lm["x"], lm["y"], lm.get("z", 0.0))
+                             for lm in data.get("landmarks", [])]
+                batch.append((zone, rows, landmarks))
+            self._write(conn, batch)
+            try:
+                os.replace(self.legacy_json, self.legacy_json.with_name(self.legacy_json.name + ".migrated"))
+            except OSError:
+                pass
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('migrated_json', '1')")
+
+    def load_zone(self, zone: str) -> Optional[ZoneData]:
+        conn = self._reader_connection()
+        if not conn.execute("SELECT 1 FROM zones WHERE name = ?", (zone,)).fetchone():
+            return None
+        data = ZoneData(zone)
+        for cx, cy, min_x, max_x, min_y, max_y, visits, name in conn.execute(
+                "SELECT cx, cy, min_x, max_x, min_y, max_y, visits, name FROM areas WHERE zone = ?", (zone,)):
+            data.areas[(cx, cy)] = AreaCell(min_x, max_x, min_y, max_y, visits, name)
+        data.landmarks = [
+            {"name": name, "x": x, "y": y, "z": z}
+            for name, x, y, z in conn.execute("SELECT name, x, y, z FROM landmarks WHERE zone = ?", (zone,))
+        ]
+        return data
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, batch: list):
+        with conn:
+            for zone, area_rows, landmark_rows in batch:
+                conn.execute("INSERT OR IGNORE INTO zones VALUES (?)", (zone,))
+                conn.executemany("INSERT OR REPLACE INTO areas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", area_rows)
+                if landmark_rows is not None:
+                    conn.execute("DELETE FROM landmarks WHERE zone = ?", (zone,))
+                    conn.executemany("INSERT INTO landmarks VALUES (?, ?, ?, ?, ?)", landmark_rows)
+
+    def write(self, batch: list):
+        """batch: (zone, area rows, landmark rows or None to leave them alone) per zone"""
+        with self._write_lock:
+            self._write(self._writer_connection(), batch)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
 
 class LocationTracker:
     """Tracks and manages game locations and landmarks"""
-    def __init__(self):
-        self.data_file = Path("location_data.json")
-        self.locations = self._load_data()
+    def __init__(self, flush_interval: float = 5.0, flush_threshold: int = 50, max_zones: int = 16):
+        # Zones live in SQLite and are loaded on first use, nothing is read at import
+        self.data_file = Path("location_data.db")
+        self.store = LocationStore(self.data_file, legacy_json=Path("location_data.json"))
+        self.max_zones = max_zones
+        self._zones: "collections.OrderedDict[str, ZoneData]" = collections.OrderedDict()
+        self._absent = set()
+        # Write-behind: updates only touch memory, a background task persists them
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._dirty = 0
+        self._flushing = False
+        self._closing = False
+        self._flush_task = None
+        self._flush_wakeup = None
     
-    def _load_data(self):
-        if self.data_file.exists():
-            try:
-                return json.loads(self.data_file.read_text())
-            except:
-                return {}
-        return {}
+    def _zone(self, zone: str, create: bool = False) -> Optional[ZoneData]:
+        data = self._zones.get(zone)
+        if data is not None:
+            self._zones.move_to_end(zone)
+            return data
+        if zone not in self._absent:
+            data = self.store.load_zone(zone)
+        if data is None:
+            if not create:
+                self._absent.add(zone)
+                return None
+            self._absent.discard(zone)
+            data = ZoneData(zone)
+        self._zones[zone] = data
+        # The caller is about to modify this zone, so it stays even if that puts us over max_zones
+        self._evict(keep=zone)
+        return data
+    
+    def _evict(self, keep: Optional[str] = None):
+        # Least recently used clean zones go first; dirty ones wait for their flush
+        if self._flushing:
+            return
+        while len(self._zones) > self.max_zones:
+            for name, data in self._zones.items():
+                if not data.dirty and name != keep:
+                    del self._zones[name]
+                    break
+            else:
+                return
+    
+    def _take_dirty(self) -> list:
+        batch = []
+        for zone, data in self._zones.items():
+            if not data.dirty:
+                continue
+            area_rows = []
+            for key in data.dirty_areas:
+                cell = data.areas[key]
+                area_rows.append((zone, key[0], key[1], cell.min_x, cell.max_x, cell.min_y, cell.max_y,
+                                  cell.visits, cell.name))
+            landmark_rows = None
+            if data.landmarks_dirty:
+                landmark_rows = [(zone, lm["name"], lm["x"], lm["y"], lm["z"]) for lm in data.landmarks]
+            batch.append((zone, area_rows, landmark_rows))
+            data.dirty_areas = set()
+            data.landmarks_dirty = False
+        return batch
+    
+    def _restore_dirty(self, batch: list):
+        for zone, area_rows, landmark_rows in batch:
+            data = self._zones.get(zone)
+            if data is None:
+                continue
+            data.dirty_areas.update((row[1], row[2]) for row in area_rows)
+            data.landmarks_dirty = data.landmarks_dirty or landmark_rows is not None
     
     def _save_data(self):
-        self.data_file.write_text(json.dumps(self.locations, indent=2))
+        self._dirty = 0
+        batch = self._take_dirty()
+        try:
+            self.store.write(batch)
+        except Exception:
+            self._restore_dirty(batch)
+            raise
+    
+    def _mark_dirty(self):
+        self._dirty += 1
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to flush from, fall back to writing through
+            self._save_data()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_wakeup = asyncio.Event()
+            self._flush_task = background_task(self._flush_loop())
+        if self._dirty >= self.flush_threshold:
+            self._flush_wakeup.set()
+    
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            if self._dirty:
+                await self.flush()
+    
+    async def open(self):
+        """Open the store and migrate old JSON data off the event loop"""
+        await asyncio.get_running_loop().run_in_executor(None, self.store.open)
+
+    async def flush(self):
+        """Persist pending updates without blocking the event loop"""
+        if not self._dirty:
+            return
+        pending = self._dirty
+        self._dirty = 0
+        batch = self._take_dirty()
+        self._flushing = True
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.store.write, batch)
+        except Exception as e:
+            self._dirty += pending
+            self._restore_dirty(batch)
+            print(f"Error saving location data: {e}")
+        finally:
+            self._flushing = False
+            self._evict()
+    
+    async def close(self):
+        """Stop the background flusher and write any pending updates"""
+        if self._flush_task and not self._flush_task.done():
+            self._closing = True
+            self._flush_wakeup.set()
+            try:
+                await self._flush_task
+            finally:
+                self._flush_task = None
+                self._closing = False
+        if self._dirty:
+            self._save_data()
+        self.store.close()
     
     def update_location(self, zone: str, x: float, y: float, z: float):
-        if zone not in self.locations:
-            self.locations[zone] = {
-                "areas": {},
-                "landmarks": []
-            }
-        area_key = f"{int(x//100)},{int(y//100)}"
-        if area_key not in self.locations[zone]["areas"]:
-            self.locations[zone]["areas"][area_key] = {
-                "min_x": x, "max_x": x,
-                "min_y": y, "max_y": y,
-                "visits": 0
-            }
-        area = self.locations[zone]["areas"][area_key]
-        area["min_x"] = min(area["min_x"], x)
-        area["max_x"] = max(area["max_x"], x)
-        area["min_y"] = min(area["min_y"], y)
-        area["max_y"] = max(area["max_y"], y)
-        area["visits"] += 1
-        self._save_data()
+        self.merge_area(zone, int(x // AREA_CELL_SIZE), int(y // AREA_CELL_SIZE), x, x, y, y, 1)
+    
+    def merge_area(self, zone: str, cx: int, cy: int, min_x: float, max_x: float,
+                   min_y: float, max_y: float, visits: int):
+        """Fold pre-aggregated samples for one cell into the zone"""
+        data = self._zone(zone, create=True)
+        area_key = (cx, cy)
+        area = data.areas.get(area_key)
+        if area is None:
+            area = data.areas[area_key] = AreaCell(min_x, max_x, min_y, max_y)
+        area.min_x = min(area.min_x, min_x)
+        area.max_x = max(area.max_x, max_x)
+        area.min_y = min(area.min_y, min_y)
+        area.max_y = max(area.max_y, max_y)
+        area.visits += visits
+        data.dirty_areas.add(area_key)
+        self._mark_dirty()
     
     def get_location_info(self, zone: str, x: float, y: float, z: float) -> dict:
-        if zone not in self.locations:
+        data = self._zone(zone)
+        if data is None:
             return {"area": "Unknown Area", "landmark": None}
-        area_key = f"{int(x//100)},{int(y//100)}"
-        if area_key in self.locations[zone]["areas"]:
-            area = self.locations[zone]["areas"][area_key]
+        area = data.areas.get((int(x // AREA_CELL_SIZE), int(y // AREA_CELL_SIZE)))
+        nearest = self.nearest_landmarks(zone, x, y, 1)
+        return {
+            "area": area.name if area is not None and area.name else "Unknown Area",
+            "landmark": nearest[0][1]["name"] if nearest and nearest[0][0] < 50 else None
+        }
+    
+    def _landmark_grid(self, zone: str) -> Optional[LandmarkGrid]:
+        data = self._zone(zone)
+        if data is None:
+            return None
+        if data.grid is None:
+            data.grid = LandmarkGrid(data.landmarks)
+        return data.grid
+    
+    def add_landmark(self, zone: str, name: str, x: float, y: float, z: float) -> dict:
+        data = self._zone(zone, create=True)
+        landmark = {"name": name, "x": x, "y": y, "z": z}
+        data.landmarks.append(landmark)
+        if data.grid is not None:
+            data.grid.add(landmark)
+        data.landmarks_dirty = True
+        self._mark_dirty()
+        return landmark
+    
+    def remove_landmark(self, zone: str, name: str) -> bool:
+        data = self._zone(zone)
+        if data is None:
+            return False
+        for idx, landmark in enumerate(data.landmarks):
+            if landmark["name"] == name:
+                del data.landmarks[idx]
+                if data.grid is not None:
+                    data.grid.remove(landmark)
+                data.landmarks_dirty = True
+                self._mark_dirty()
+                return True
+        return False
+    
+    def nearest_landmarks(self, zone: str, x: float, y: float, k: int = 1) -> List[tuple]:
+        """Return up to k (distance, landmark) pairs, closest first"""
+        grid = self._landmark_grid(zone)
+        return grid.nearest(x, y, k) if grid else []
+    
+    def landmarks_within(self, zone: str, x: float, y: float, radius: float) -> List[tuple]:
+        """Return all (distance, landmark) pairs within radius, closest first"""
+        grid = self._landmark_grid(zone)
+        return grid.within(x, y, radius) if grid else []
+
+location_tracker = LocationTracker()
+
+class PositionSampler:
+    """Samples every client's position at a fixed rate into a ring buffer and folds
+    the samples into LocationTracker's area cells in batches"""
+    def __init__(self, tracker: "LocationTracker", rate: float = 10.0, capacity: int = 8192,
+                 fold_interval: float = 2.0, zone_refresh: float = 1.0):
+        self.tracker = tracker
+        self.rate = rate
+        self.capacity = capacity
+        self.fold_interval = fold_interval
+        self.zone_refresh = zone_refresh
+        # Parallel fixed-size arrays instead of one object per sample
+        self._xs = array.array("d", bytes(8 * capacity))
+        self._ys = array.array("d", bytes(8 * capacity))
+        self._zone_ids = array.array("i", bytes(4 * capacity))
+        self._head = 0
+        self._size = 0
+        self._zone_names: List[str] = []
+        self._zone_lookup: Dict[str, int] = {}
+        self.samples = 0
+        self.dropped = 0
+        self._tasks: List[asyncio.Task] = []
+        self._fold_wakeup = None
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def _zone_id(self, zone: str) -> int:
+        zone_id = self._zone_lookup.get(zone)
+        if zone_id is None:
+            zone_id = self._zone_lookup[zone] = len(self._zone_names)
+            self._zone_names.append(zone)
+        return zone_id
+
+    def _append(self, zone_id: int, x: float, y: float):
+        if self._size == self.capacity:
+            # Folding fell behind, overwrite the oldest sample
+            self._size -= 1
+            self.dropped += 1
+        self._xs[self._head] = x
+        self._ys[self._head] = y
+        self._zone_ids[self._head] = zone_id
+        self._head = (self._head + 1) % self.capacity
+        self._size += 1
+        self.samples += 1
+        if self._size >= self.capacity // 2:
+            self._fold_wakeup.set()
+
+    async def _sample_client(self, client):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.rate
+        zone_id = None
+        zone_checked = 0.0
+        next_tick = loop.time()
+        while True:
+            try:
+                # Loading is read with every position, a zone change always passes through it
+                position, loading = await asyncio.gather(client.body.position(), client.is_loading())
+                if loading:
+                    zone_id = None
+                else:
+                    if zone_id is None or loop.time() - zone_checked >= self.zone_refresh:
+                        zone_id = self._zone_id(await client.zone_name())
+                        zone_checked = loop.time()
+                    self._append(zone_id, position.x, position.y)
+            except Exception:
+                zone_id = None  # likely loading, re-read the zone once it's back
+            next_tick += period
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Reads are slower than the rate, don't try to catch up
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def _take(self):
+        """Oldest-first copies of the buffered samples, then empty the buffer"""
+        start = (self._head - self._size) % self.capacity
+        end = start + self._size
+        if end <= self.capacity:
+            parts = [(start, end)]
+        else:
+            parts = [(start, self.capacity), (0, end - self.capacity)]
+        self._size = 0
+        if np is not None:
+            xs = np.frombuffer(self._xs, dtype=np.float64)
+            ys = np.frombuffer(self._ys, dtype=np.float64)
+            zone_ids = np.frombuffer(self._zone_ids, dtype=np.int32)
+            return tuple(np.concatenate([column[a:b] for a, b in parts]) for column in (xs, ys, zone_ids))
+        return tuple(
+            [value for a, b in parts for value in column[a:b]]
+            for column in (self._xs, self._ys, self._zone_ids)
+        )
+
+    def fold(self) -> int:
+        """Merge buffered samples into area cells, returns how many were folded"""
+        if not self._size:
+            return 0
+        xs, ys, zone_ids = self._take()
+        if np is not None:
+            cells = self._bin_numpy(xs, ys, zone_ids)
+        else:
+            cells = self._bin_python(xs, ys, zone_ids)
+        for zone_id, cx, cy, min_x, max_x, min_y, max_y, visits in cells:
+            self.tracker.merge_area(self._zone_names[zone_id], cx, cy, min_x, max_x, min_y, max_y, visits)
+        return len(xs)
+
+    @staticmethod
+    def _bin_numpy(xs, ys, zone_ids):
+        cx = np.floor_divide(xs, AREA_CELL_SIZE).astype(np.int64)
+        cy = np.floor_divide(ys, AREA_CELL_SIZE).astype(np.int64)
+        order = np.lexsort((cy, cx, zone_ids))
+        xs, ys, cx, cy, zone_ids = xs[order], ys[order], cx[order], cy[order], zone_ids[order]
+        changed = (np.diff(cx) != 0) | (np.diff(cy) != 0) | (np.diff(zone_ids) != 0)
+        starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        counts = np.diff(np.append(starts, len(xs)))
+        return zip(
+            zone_ids[starts].tolist(), cx[starts].tolist(), cy[starts].tolist(),
+            np.minimum.reduceat(xs, starts).tolist(), np.maximum.reduceat(xs, starts).tolist(),
+            np.minimum.reduceat(ys, starts).tolist(), np.maximum.reduceat(ys, starts).tolist(),
+            counts.tolist(),
+        )
+
+    @staticmethod
+    def _bin_python(xs, ys, zone_ids):
+        bins = {}
+        for x, y, zone_id in zip(xs, ys, zone_ids):
+            key = (zone_id, int(x // AREA_CELL_SIZE), int(y // AREA_CELL_SIZE))
+            cell = bins.get(key)
+            if cell is None:
+                bins[key] = [x, x, y, y, 1]
+            else:
+                cell[0] = min(cell[0], x)
+                cell[1] = max(cell[1], x)
+                cell[2] = min(cell[2], y)
+                cell[3] = max(cell[3], y)
+                cell[4] += 1
+        return [key + tuple(cell) for key, cell in bins.items()]
+
+    async def _fold_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._fold_wakeup.wait(), self.fold_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._fold_wakeup.clear()
+            self.fold()
+
+    def start(self, clients: list):
+        self._fold_wakeup = asyncio.Event()
+        self._tasks = [background_task(self._fold_loop())]
+        self._tasks += [background_task(self._sample_client(client)) for client in clients]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.fold()
+
+
+class BattleLogger:
+    """Queue-backed battle log, callers only enqueue and a background task writes batches"""
+    def __init__(self, path: str = "battle_monitor.log", max_bytes: int = 5 * 1024 * 1024,
+                 backup_count: int = 3, json_lines: bool = False, flush_interval: float = 0.25,
+                 batch_size: int = 256, max_pending: int = 10000):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.json_lines = json_lines
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = collections.deque()
+        # Last block logged per state key, for change-only output
+        self._last_state: Dict[str, str] = {}
+        self._repeats: Dict[str, int] = {}
+        self._file = None
+        self._io_lock = threading.Lock()
+        self._closing = False
+        self._writer_task = None
+        self._wakeup = None
+        atexit.register(self.flush_sync)
+
+    def log(self, msg: str, **fields):
+        if len(self._pending) >= self.max_pending:
+            self._pending.popleft()
+            self.dropped += 1
+        self._pending.append((time.time(), msg, fields))
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return
+        if self._writer_task is None or self._writer_task.done():
+            self._wakeup = asyncio.Event()
+            self._writer_task = background_task(self._writer_loop())
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def log_state(self, key: str, msg: str, sample_every: int = 0, **fields) -> bool:
+        """Log a per-tick state block only if it changed since the last one for key.
+        With sample_every=N an unchanged block is still written every Nth call."""
+        if self._last_state.get(key) == msg:
+            repeats = self._repeats.get(key, 0) + 1
+            self._repeats[key] = repeats
+            if not sample_every or repeats % sample_every:
+                return False
         else:
-            area = {"area": "Unexplored Area"}
-        nearest_landmark = None
-        min_dist = float('inf')
-        for landmark in self.locations[zone]["landmarks"]:
-            dist = math.sqrt(
-                (x - landmark["x"])**2 + 
-                (y - landmark["y"])**2
+            self._last_state[key] = msg
+            self._repeats[key] = 0
+        self.log(msg, **fields)
+        return True
+
+    def _format(self, record) -> str:
+        timestamp, msg, fields = record
+        if self.json_lines:
+            return json.dumps({
+                "ts": datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds"),
+                "msg": msg,
+                **fields
+            }) + "\n"
+        stamp = datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        return f"[{stamp}] {msg}\n"
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        try:
+            if self.backup_count > 0:
+                for idx in range(self.backup_count - 1, 0, -1):
+                    src = self.path.with_name(f"{self.path.name}.{idx}")
+                    if src.exists():
+                        os.replace(src, self.path.with_name(f"{self.path.name}.{idx + 1}"))
+                os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+            else:
+                open(self.path, "w").close()
+        except OSError:
+            pass  # e.g. a viewer holds the file open on Windows; keep appending
+
+    def _write_batch(self, batch: list):
+        data = "".join(self._format(record) for record in batch)
+        with self._io_lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            if self.max_bytes and self._file.tell() and self._file.tell() + len(data) > self.max_bytes:
+                self._rotate()
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(data)
+            self._file.flush()
+
+    def _take_batch(self) -> list:
+        batch = list(self._pending)
+        self._pending.clear()
+        return batch
+
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                batch = self._take_batch()
+                try:
+                    await loop.run_in_executor(None, self._write_batch, batch)
+                except Exception as e:
+                    print(f"Error writing battle log: {e}")
+
+    def flush_sync(self):
+        if self._pending:
+            self._write_batch(self._take_batch())
+
+    async def close(self):
+        """Drain pending records and close the log file"""
+        if self._writer_task and not self._writer_task.done():
+            self._closing = True
+            self._wakeup.set()
+            try:
+                await self._writer_task
+            finally:
+                self._writer_task = None
+                self._closing = False
+        self.flush_sync()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+battle_logger = BattleLogger()
+
+# Where EventBroker listens by default; a filesystem path means a Unix domain socket
+EVENT_STREAM_ADDRESS = "127.0.0.1:47321"
+
+class _Subscriber:
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int):
+        self.writer = writer
+        self.queue = collections.deque(maxlen=queue_size)
+        self.wakeup = asyncio.Event()
+        self.events = None  # None means every event
+        self.dropped = 0
+        self.task = None
+
+class EventBroker:
+    """Publishes battle events to local subscribers as newline-delimited JSON.
+
+    Each subscriber has a bounded queue; when a slow reader falls behind the oldest
+    events are dropped and it gets a {"event": "dropped", "count": N} line instead of
+    stalling the monitor. A subscriber may send {"events": [...]} to filter."""
+    def __init__(self, address: str = EVENT_STREAM_ADDRESS, queue_size: int = 256):
+        self.address = address
+        self.queue_size = queue_size
+        self._server = None
+        self._unix_path = None
+        self._subscribers: List[_Subscriber] = []
+        # Latest state per client, replayed to new subscribers
+        self._states: Dict[str, dict] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    async def start(self):
+        if self._server is not None:
+            return
+        host, sep, port = self.address.rpartition(":")
+        if sep and port.isdigit():
+            self._server = await asyncio.start_server(self._handle, host, int(port))
+        else:
+            if os.path.exists(self.address):
+                os.remove(self.address)  # stale socket from a crashed run
+            self._server = await asyncio.start_unix_server(self._handle, self.address)
+            self._unix_path = self.address
+
+    async def stop(self):
+        if self._server is None:
+            return
+        server, self._server = self._server, None
+        server.close()
+        subscribers, self._subscribers = self._subscribers, []
+        for subscriber in subscribers:
+            # Closing the transport ends the subscriber's read loop
+            subscriber.writer.close()
+        if subscribers:
+            await asyncio.wait([subscriber.task for subscriber in subscribers], timeout=1.0)
+        await server.wait_closed()
+        if self._unix_path and os.path.exists(self._unix_path):
+            try:
+                os.remove(self._unix_path)
+            except OSError:
+                pass
+
+    def publish(self, event: str, **fields):
+        if event == "state" and "client" in fields:
+            self._states[fields["client"]] = fields
+        if not self._subscribers:
+            return
+        record = {
+            "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "event": event,
+            **fields
+        }
+        line = (json.dumps(record) + "\n").encode()
+        for subscriber in self._subscribers:
+            if subscriber.events is not None and event not in subscriber.events:
+                continue
+            if len(subscriber.queue) == subscriber.queue.maxlen:
+                subscriber.dropped += 1
+            subscriber.queue.append(line)
+            subscriber.wakeup.set()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriber = _Subscriber(writer, self.queue_size)
+        subscriber.queue.append((json.dumps({
+            "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "event": "hello",
+            "states": list(self._states.values()),
+        }) + "\n").encode())
+        subscriber.wakeup.set()
+        subscriber.task = asyncio.current_task()
+        self._subscribers.append(subscriber)
+        sender = asyncio.create_task(self._send_loop(subscriber))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    subscriber.events = set(request["events"]) if request.get("events") else None
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            sender.cancel()
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+            writer.close()
+
+    async def _send_loop(self, subscriber: _Subscriber):
+        writer = subscriber.writer
+        try:
+            while True:
+                await subscriber.wakeup.wait()
+                subscriber.wakeup.clear()
+                if subscriber.dropped:
+                    record = {
+                        "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                        "event": "dropped",
+                        "count": subscriber.dropped
+                    }
+                    writer.write((json.dumps(record) + "\n").encode())
+                    subscriber.dropped = 0
+                while subscriber.queue:
+                    writer.write(subscriber.queue.popleft())
+                await writer.drain()
+        except (ConnectionError, OSError):
+            writer.close()
+
+event_broker = EventBroker()
+
+def log_battle_event(msg: str, **fields):
+    battle_logger.log(msg, **fields)
+    if "event" in fields:
+        event_broker.publish(fields["event"], msg=msg, **{k: v for k, v in fields.items() if k != "event"})
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of durations in microseconds, fixed size, ~6% relative error"""
+    SUB_BUCKETS = 16
+    MAX_EXPONENT = 32
+
+    def __init__(self):
+        self.counts = [0] * ((self.MAX_EXPONENT + 1) * self.SUB_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, micros: int) -> int:
+        if micros < self.SUB_BUCKETS:
+            return micros
+        exponent = micros.bit_length() - 5
+        return min(exponent * self.SUB_BUCKETS + (micros >> exponent), len(self.counts) - 1)
+
+    def _value(self, index: int) -> float:
+        if index < self.SUB_BUCKETS:
+            return float(index)
+        exponent, sub = divmod(index, self.SUB_BUCKETS)
+        exponent -= 1
+        # Middle of the bucket's [low, high) range
+        return ((sub + self.SUB_BUCKETS) + 0.5) * (1 << exponent)
+
+    def record(self, seconds: float):
+        self.counts[self._index(max(0, int(seconds * 1_000_000)))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """Value in seconds below which the given fraction of samples fall"""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * fraction))
+        seen = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= target:
+                return min(self._value(index) / 1_000_000, self.max)
+        return self.max
+
+class HotPathStats:
+    """Per-operation call counts, errors and latency histograms for client reads and writes"""
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self):
+        self.started = time.time()
+        self.operations: Dict[str, LatencyHistogram] = {}
+        self.errors = collections.Counter()
+        self.tick_lateness = LatencyHistogram()
+        # Confirmed battle state changes, and how long each state lasted
+        self.transitions = collections.Counter()
+        self.dwell: Dict[str, LatencyHistogram] = {}
+        self._speed_writes = collections.deque(maxlen=4096)
+        self._export_task = None
+
+    def record(self, name: str, seconds: float):
+        histogram = self.operations.get(name)
+        if histogram is None:
+            histogram = self.operations[name] = LatencyHistogram()
+        histogram.record(seconds)
+
+    async def timed(self, name: str, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        except Exception:
+            self.errors[name] += 1
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def speed_write(self):
+        self._speed_writes.append(time.monotonic())
+
+    def transition(self, transition):
+        if transition.previous is None:
+            return
+        self.transitions[(transition.previous, transition.state)] += 1
+        histogram = self.dwell.get(transition.previous)
+        if histogram is None:
+            histogram = self.dwell[transition.previous] = LatencyHistogram()
+        histogram.record(transition.dwell)
+
+    def speed_writes_per_minute(self) -> int:
+        cutoff = time.monotonic() - 60
+        while self._speed_writes and self._speed_writes[0] < cutoff:
+            self._speed_writes.popleft()
+        return len(self._speed_writes)
+
+    def reset(self):
+        export_task = self._export_task
+        self.__init__()
+        self._export_task = export_task
+
+    def report(self) -> str:
+        lines = [f"{'operation':<28}{'calls':>8}{'errors':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}"]
+        rows = sorted(self.operations.items()) + [("tick lateness", self.tick_lateness)]
+        rows += [(f"dwell {state}", histogram) for state, histogram in sorted(self.dwell.items())]
+        for name, histogram in rows:
+            if not histogram.count:
+                continue
+            lines.append(
+                f"{name:<28}{histogram.count:>8}{self.errors.get(name, 0):>8}"
+                + "".join(f"{histogram.percentile(q) * 1000:>9.2f}" for q in self.QUANTILES)
+                + f"{histogram.max * 1000:>9.2f}"
+            )
+        lines.append(f"Speed writes in the last minute: {self.speed_writes_per_minute()}")
+        if self.transitions:
+            lines.append("State transitions: " + ", ".join(
+                f"{previous}->{state} {count}" for (previous, state), count in sorted(self.transitions.items())))
+        return "\n".join(lines)
+
+    def prometheus_text(self) -> str:
+        def summary(metric: str, histogram: LatencyHistogram, labels: str = ""):
+            sep = "," if labels else ""
+            for q in self.QUANTILES:
+                out.append(f'{metric}{{{labels}{sep}quantile="{q}"}} {histogram.percentile(q):.6f}')
+            suffix = f"{{{labels}}}" if labels else ""
+            out.append(f"{metric}_sum{suffix} {histogram.total:.6f}")
+            out.append(f"{metric}_count{suffix} {histogram.count}")
+
+        out = [
+            "# HELP wizwalker_client_op_seconds Latency of client reads and writes",
+            "# TYPE wizwalker_client_op_seconds summary",
+        ]
+        for name, histogram in sorted(self.operations.items()):
+            summary("wizwalker_client_op_seconds", histogram, f'op="{name}"')
+        out += [
+            "# HELP wizwalker_client_op_errors_total Client reads and writes that raised",
+            "# TYPE wizwalker_client_op_errors_total counter",
+        ]
+        for name in sorted(self.operations):
+            out.append(f'wizwalker_client_op_errors_total{{op="{name}"}} {self.errors.get(name, 0)}')
+        out += [
+            "# HELP wizwalker_monitor_tick_lateness_seconds How late monitor ticks fire relative to schedule",
+            "# TYPE wizwalker_monitor_tick_lateness_seconds summary",
+        ]
+        summary("wizwalker_monitor_tick_lateness_seconds", self.tick_lateness)
+        out += [
+            "# HELP wizwalker_speed_writes_per_minute Speed writes during the last 60 seconds",
+            "# TYPE wizwalker_speed_writes_per_minute gauge",
+            f"wizwalker_speed_writes_per_minute {self.speed_writes_per_minute()}",
+            "# HELP wizwalker_state_transitions_total Confirmed battle state changes",
+            "# TYPE wizwalker_state_transitions_total counter",
+        ]
+        for (previous, state), count in sorted(self.transitions.items()):
+            out.append(f'wizwalker_state_transitions_total{{from="{previous}",to="{state}"}} {count}')
+        out += [
+            "# HELP wizwalker_state_dwell_seconds Time spent in a battle state before it changed",
+            "# TYPE wizwalker_state_dwell_seconds summary",
+        ]
+        for state, histogram in sorted(self.dwell.items()):
+            summary("wizwalker_state_dwell_seconds", histogram, f'state="{state}"')
+        return "\n".join(out) + "\n"
+
+    def write_textfile(self, path: str):
+        # node_exporter may read at any time, so swap the file in atomically
+        target = Path(path)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{target.name}.", dir=str(target.parent))
+        with os.fdopen(fd, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, target)
+
+    async def _export_loop(self, path: str, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.write_textfile, path)
+            except Exception as e:
+                print(f"Error writing stats textfile: {e}")
+            await asyncio.sleep(interval)
+
+    def start_export(self, path: str, interval: float = 15.0):
+        self.stop_export()
+        self._export_task = background_task(self._export_loop(path, interval))
+
+    def stop_export(self):
+        if self._export_task is not None:
+            self._export_task.cancel()
+            self._export_task = None
+
+client_stats = HotPathStats()
+
+async def _read_or(default, coro):
+    try:
+        return await coro
+    except Exception:
+        return default
+
+def classify_battle_state(in_battle: bool, duel_phase) -> Optional[str]:
+    """Battle state from already-read values, None when the phase alone can't tell"""
+    if not in_battle:
+        return "not_in_battle"
+    phase = getattr(duel_phase, "name", duel_phase)
+    if phase == "execution":
+        return "playing_animation"
+    if phase == "planning":
+        return "planning"
+    return None
+
+class WindowCache:
+    """Remembers windows found by name so a tick only re-validates them instead of walking the UI tree"""
+    def __init__(self, client, negative_ttl: float = 1.0, max_age: float = 5.0):
+        self.client = client
+        # How long a "not found" result is trusted, and when a hit is re-walked anyway
+        self.negative_ttl = negative_ttl
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0
+        self._entries: Dict[str, tuple] = {}
+        self._was_loading = False
+
+    def invalidate(self):
+        self._entries.clear()
+
+    async def check_loading(self) -> bool:
+        """Drop every handle while loading or right after it, the UI tree is rebuilt then"""
+        loading = await _read_or(False, client_stats.timed("is_loading", self.client.is_loading()))
+        self.reads += 1
+        if loading or loading != self._was_loading:
+            self.invalidate()
+        self._was_loading = loading
+        return loading
+
+    async def _still_valid(self, window, name: str) -> bool:
+        try:
+            window_name, parent = await asyncio.gather(
+                client_stats.timed("window.name", window.name()),
+                client_stats.timed("window.parent", window.parent()),
+            )
+        except Exception:
+            return False
+        finally:
+            self.reads += 2
+        return window_name == name and parent is not None
+
+    async def get_windows_with_name(self, name: str) -> list:
+        now = time.monotonic()
+        entry = self._entries.get(name)
+        if entry is not None:
+            windows, found_at = entry
+            age = now - found_at
+            if not windows and age < self.negative_ttl:
+                self.hits += 1
+                return windows
+            # Windows with one name are replaced together, checking the first is enough
+            if windows and age < self.max_age and await self._still_valid(windows[0], name):
+                self.hits += 1
+                return windows
+        self.misses += 1
+        windows = await client_stats.timed(
+            "get_windows_with_name", self.client.root_window.get_windows_with_name(name))
+        self.reads += 1
+        self._entries[name] = (windows, now)
+        return windows
+
+class ClientSnapshot:
+    """Everything the battle monitor needs from a client, read at most once per tick"""
+    __slots__ = ("in_battle", "duel_phase", "combat_windows", "duel_windows", "state", "reads")
+
+    def __init__(self):
+        self.in_battle = False
+        self.duel_phase = None
+        self.combat_windows = []
+        self.duel_windows = []
+        self.state = "not_in_battle"
+        self.reads = 0
+
+    @classmethod
+    async def capture(cls, client, windows: Optional[WindowCache] = None, debug: bool = False) -> "ClientSnapshot":
+        """Window lookups only feed the debug block, so they're skipped unless debug is set"""
+        snap = cls()
+        # Independent reads go out together instead of one round trip each
+        snap.in_battle, snap.duel_phase = await asyncio.gather(
+            client_stats.timed("in_battle", client.in_battle()),
+            _read_or("Unknown", client_stats.timed("duel_phase", client.duel.duel_phase())),
+        )
+        snap.reads = 2
+        if debug and snap.in_battle:
+            if windows is None:
+                lookup = client.root_window
+                snap.reads += 2
+            else:
+                lookup = windows
+                reads_before = windows.reads
+                await windows.check_loading()
+            combat_lookup = lookup.get_windows_with_name("CombatantControl")
+            duel_lookup = lookup.get_windows_with_name("duelWindow")
+            if windows is None:
+                combat_lookup = client_stats.timed("get_windows_with_name", combat_lookup)
+                duel_lookup = client_stats.timed("get_windows_with_name", duel_lookup)
+            snap.combat_windows, snap.duel_windows = await asyncio.gather(
+                _read_or([], combat_lookup),
+                _read_or([], duel_lookup),
             )
-            if dist < min_dist:
-                min_dist = dist
-                nearest_landmark = landmark
+            if windows is not None:
+                snap.reads += windows.reads - reads_before
+        state = classify_battle_state(snap.in_battle, snap.duel_phase)
+        if state is None:
+            # Transitional phase, let the client's own detection decide
+            state = await client_stats.timed("detect_battle_state", client.detect_battle_state())
+            snap.reads += 1
+        snap.state = state
+        return snap
+
+class InfoSnapshot:
+    """Client status for the info and watch commands, read concurrently"""
+    __slots__ = ("zone", "position", "in_battle", "in_dialog", "in_npc_range", "is_loading",
+                 "quest_id", "goal_id", "duel_phase")
+
+    @classmethod
+    async def capture(cls, client, previous: Optional["InfoSnapshot"] = None) -> "InfoSnapshot":
+        """With a previous snapshot, zone and quest ID are reused unless a loading screen came in between"""
+        snap = cls()
+        (snap.position, snap.in_battle, snap.in_dialog, snap.in_npc_range,
+         snap.is_loading, snap.goal_id, snap.duel_phase) = await asyncio.gather(
+            client.body.position(),
+            client.in_battle(),
+            client.is_in_dialog(),
+            client.is_in_npc_range(),
+            client.is_loading(),
+            client.goal_id(),
+            _read_or(None, client.duel.duel_phase()),
+        )
+        if previous is None or snap.is_loading or previous.is_loading:
+            snap.zone, snap.quest_id = await asyncio.gather(client.zone_name(), client.quest_id())
+        else:
+            snap.zone, snap.quest_id = previous.zone, previous.quest_id
+        return snap
+
+    def format(self, speed: float) -> str:
+        lines = [
+            "\n=== Client Information ===",
+            f"Zone: {self.zone}",
+            f"Position: {self.position}",
+            f"Loading: {self.is_loading}",
+            f"Speed: {speed}x",
+            "\n=== Status ===",
+            f"In Battle: {self.in_battle}",
+            f"In Dialog: {self.in_dialog}",
+            f"In NPC Range: {self.in_npc_range}",
+            "\n=== Quest ===",
+            f"Quest ID: {self.quest_id}",
+            f"Goal ID: {self.goal_id}",
+        ]
+        if self.in_battle:
+            lines.append(f"Duel Phase: {self.duel_phase}" if self.duel_phase is not None else "Duel details unavailable")
+        return "\n".join(lines)
+
+# Duel phases that sit right before the phase the monitor cares about
+TRANSITIONAL_PHASES = ("starting", "pre_planning", "pre_execution", "resolution")
+
+class PollScheduler:
+    """Chooses the delay before a client's next tick: fast around expected transitions,
+    exponential back-off while a phase stays stable"""
+    def __init__(self, floor: float = 0.05, ceiling: float = 1.0, battle_ceiling: float = 0.1,
+                 backoff: float = 1.5, history: int = 8):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.battle_ceiling = battle_ceiling
+        self.backoff = backoff
+        self.interval = floor
+        self.state = None
+        self.state_since = None
+        self.last_poll = None
+        self.previous_poll = None
+        # Recent durations per state, to tighten polling when a phase usually ends
+        self._durations: Dict[str, collections.deque] = {}
+        self._history = history
+        self.latencies = collections.deque(maxlen=256)
+
+    def tick_started(self, now: Optional[float] = None):
+        self.previous_poll = self.last_poll
+        self.last_poll = time.monotonic() if now is None else now
+
+    def _typical_duration(self, state: str) -> Optional[float]:
+        durations = self._durations.get(state)
+        if not durations:
+            return None
+        return sorted(durations)[len(durations) // 2]
+
+    def observe(self, state: str, duel_phase=None) -> float:
+        """Feed the state seen this tick, returns the delay before the next one"""
+        now = self.last_poll if self.last_poll is not None else time.monotonic()
+        if state != self.state:
+            if self.state is not None and self.state_since is not None:
+                self._durations.setdefault(self.state, collections.deque(maxlen=self._history)).append(
+                    now - self.state_since)
+            self.state = state
+            self.state_since = now
+            self.interval = self.floor
+            return self.interval
+
+        ceiling = self.ceiling if state == "not_in_battle" else self.battle_ceiling
+        self.interval = min(max(self.interval * self.backoff, self.floor), ceiling)
+        if getattr(duel_phase, "name", duel_phase) in TRANSITIONAL_PHASES:
+            self.interval = self.floor
+        typical = self._typical_duration(state)
+        if typical is not None and state != "not_in_battle" and now - self.state_since >= typical * 0.75:
+            # Phase is about as old as it usually gets, watch closely for its end
+            self.interval = self.floor
+        return self.interval
+
+    def record_speed_change(self, now: Optional[float] = None, since: Optional[float] = None) -> Optional[float]:
+        """Store the worst-case delay from transition to speed write: the transition
+        happened at the earliest right after the previous poll, or at since if given"""
+        since = self.previous_poll if since is None else since
+        if since is None:
+            return None
+        latency = (time.monotonic() if now is None else now) - since
+        self.latencies.append(latency)
+        return latency
+
+    def latency_summary(self) -> Optional[dict]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
         return {
-            "area": area.get("name", "Unknown Area"),
-            "landmark": nearest_landmark["name"] if nearest_landmark and min_dist < 50 else None
+            "count": len(ordered),
+            "p50": ordered[len(ordered) // 2],
+            "p90": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))],
+            "max": ordered[-1],
         }
 
-location_tracker = LocationTracker()
+# A confirmed battle state change. at is wall-clock time the new state was first seen;
+# since (the poll before that), confirmed and dwell (time in previous) use the monotonic clock
+StateTransition = collections.namedtuple("StateTransition", "client previous state at since confirmed dwell")
+
+class BattleStateMachine:
+    """Debounced battle state for one client: a new state is only accepted once it's been
+    read confirm_ticks times in a row and has held for confirm_time seconds. Either setting
+    can be a dict keyed by target state."""
+    def __init__(self, label: str, confirm_ticks=2, confirm_time=0.0):
+        self.label = label
+        self.confirm_ticks = confirm_ticks
+        self.confirm_time = confirm_time
+        self.state = None
+        self.entered = None
+        self.rejected = 0
+        self._last_poll = None
+        self._candidate = None
+        self._candidate_count = 0
+        self._candidate_first = None
+        self._candidate_since = None
+        self._candidate_at = None
 
-def log_battle_event(msg: str):
-    with open("battle_monitor.log", "a", encoding="utf-8") as f:
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        f.write(f"[{timestamp}] {msg}\n")
+    @staticmethod
+    def _setting(value, state: str, default):
+        return value.get(state, default) if isinstance(value, dict) else value
+
+    def observe(self, state: str, now: Optional[float] = None) -> Optional[StateTransition]:
+        """Feed this tick's raw state, returns a StateTransition when the state changes"""
+        now = time.monotonic() if now is None else now
+        last_poll, self._last_poll = self._last_poll, now
+        if self.state is None:
+            # Nothing to debounce against yet, take the first reading
+            self.state = state
+            self.entered = now
+            return StateTransition(self.label, None, state, time.time(), now, now, 0.0)
+        if state == self.state:
+            if self._candidate is not None:
+                self.rejected += 1
+                self._candidate = None
+            return None
+        if state != self._candidate:
+            self._candidate = state
+            self._candidate_count = 0
+            self._candidate_first = now
+            self._candidate_since = last_poll if last_poll is not None else now
+            self._candidate_at = time.time()
+        self._candidate_count += 1
+        if (self._candidate_count < self._setting(self.confirm_ticks, state, 1)
+                or now - self._candidate_first < self._setting(self.confirm_time, state, 0.0)):
+            return None
+        transition = StateTransition(self.label, self.state, state, self._candidate_at,
+                                     self._candidate_since, now, self._candidate_first - self.entered)
+        self.state = state
+        self.entered = self._candidate_first
+        self._candidate = None
+        return transition
 
 class EnhancedWizWalker(ClientHandler):
     def __init__(self, speed_multiplier: float = 1.0):
@@ -87,14 +1414,47 @@ class EnhancedWizWalker(ClientHandler):
         self.current_battle_state = "not_in_battle"
         self.running = True
         self.clients = []
-        self._battle_task = None
+        # One supervised monitor task per client
+        self._battle_tasks: Dict[object, asyncio.Task] = {}
         self.monitor_process = None
+        # Open a viewer console when fast battles are enabled (Windows only)
+        self.open_monitor_window = True
+        # Last speed (x100) confirmed written per client, so unchanged speeds aren't rewritten
+        self._speed_cache: Dict[object, int] = {}
+        # Normal speed set for individual clients with '@N speed', overriding speed_multiplier
+        self.client_speeds: Dict[object, float] = {}
+        # Seconds between readbacks that re-assert a drifted speed, None disables
+        self.speed_readback_interval: Optional[float] = 5.0
+        # Monitor tick interval bounds, see PollScheduler
+        self.poll_floor = 0.05
+        self.poll_ceiling = 1.0
+        # No memory signal marks a committed card, so in battle never poll slower than the old fixed 100 ms
+        self.battle_poll_ceiling = 0.1
+        self.poll_schedulers: Dict[object, PollScheduler] = {}
+        # Log window counts with each state block, costs extra UI reads per tick
+        self.battle_debug = False
+        # Debounce for battle state changes, see BattleStateMachine
+        self.state_confirm_ticks = 2
+        self.state_confirm_time = 0.0
+        self.state_machines: Dict[object, BattleStateMachine] = {}
+        # Awaited in order with (client, StateTransition) on every confirmed state change
+        self._transition_callbacks = [self._log_transition, self._speed_on_transition, self._stats_on_transition]
+        self.position_sampler: Optional[PositionSampler] = None
+        # Quest objectives per client, reused until quest or goal ID changes
+        self._objective_cache: Dict[object, tuple] = {}
+        # gotoquest skips objectives this close to a stop it already made
+        self.route_skip_radius = 50.0
+        # Startup limits: hook teardown, and per-client activation until readable
+        self.teardown_timeout = 2.0
+        self.hook_timeout = 10.0
 
     async def start(self):
         """Connect to clients and activate hooks"""
         # Clean up existing hooks
+        old_clients = list(self.clients)
         await self.close(reset_speed=False)
-        await asyncio.sleep(1.0)  # Wait for cleanup
+        if not await self._wait_until(lambda: self._hooks_torn_down(old_clients), self.teardown_timeout):
+            print("Warning: old hooks still present, continuing anyway")
 
         # Get fresh clients
         self.get_new_clients()
@@ -103,15 +1463,27 @@ class EnhancedWizWalker(ClientHandler):
             return False
 
         try:
-            # Wait for hooks to fully deactivate
-            await asyncio.sleep(0.5)
-            # Activate new hooks safely
-            for client in self.clients:
-                try:
-                    await client.activate_hooks()
-                except Exception as e:
-                    print(f"Warning: Could not activate hooks for client: {e}")
-                    continue
+            # Activate hooks on every client at once, each with its own timeout
+            results = await asyncio.gather(
+                *(self._activate_client(client) for client in self.clients),
+                return_exceptions=True
+            )
+            failed = []
+            for client, result in zip(self.clients, results):
+                label = self._client_label(client)
+                if isinstance(result, BaseException):
+                    if isinstance(result, (asyncio.TimeoutError, TimeoutError)):
+                        result = "timed out"
+                    print(f"Warning: Could not activate hooks for {label}: {result}")
+                    failed.append(client)
+                else:
+                    print(f"{label} ready in {result:.2f}s")
+
+            # Unhooked clients can't be read, keep them away from the monitors and commands
+            self.clients = [client for client in self.clients if client not in failed]
+            if not self.clients:
+                print("No client could be hooked.")
+                return False
 
             if self.speed_multiplier != 1.0:
                 await self.apply_speed(self.speed_multiplier)
@@ -122,18 +1494,65 @@ class EnhancedWizWalker(ClientHandler):
             await self.close()
             return False
 
+    @staticmethod
+    async def _wait_until(predicate, timeout: float, interval: float = 0.05) -> bool:
+        """Poll an async predicate until it's true or the timeout passes"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                if await predicate():
+                    return True
+            except Exception:
+                pass
+            if loop.time() >= deadline:
+                return False
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    async def _hooks_torn_down(clients) -> bool:
+        """True once every hook handler has unhooked and restored its autobot code.
+        HookHandler.close() only resets these after the game memory is patched back,
+        unlike the hooks dict that close() above clears itself."""
+        for client in clients:
+            hook_handler = getattr(client, 'hook_handler', None)
+            if hook_handler is None:
+                continue
+            if getattr(hook_handler, '_active_hooks', None) or getattr(hook_handler, '_autobot_address', None) is not None:
+                return False
+        return True
+
+    @staticmethod
+    async def _client_ready(client) -> bool:
+        # Player position comes through the hooks, so a good read means they're live
+        await client.body.position()
+        return True
+
+    async def _activate_client(self, client) -> float:
+        """Activate one client's hooks and wait until it's readable, returns time-to-ready"""
+        started = time.perf_counter()
+        try:
+            # Let wizwalker time out its own waits, cancelling it could stop a hook half-written
+            await client.activate_hooks(wait_for_ready=True, timeout=self.hook_timeout)
+            remaining = max(0.0, self.hook_timeout - (time.perf_counter() - started))
+            if not await self._wait_until(lambda: self._client_ready(client), remaining):
+                raise asyncio.TimeoutError()
+        except Exception:
+            # Unhook whatever did get written so the game isn't left partly patched
+            try:
+                await client.hook_handler.close()
+            except Exception:
+                pass
+            raise
+        return time.perf_counter() - started
+
     async def close(self, reset_speed=True):
         """Clean up and close connections"""
         print("Cleaning up...")
 
-        # Cancel battle monitor task
-        if self._battle_task:
-            self._battle_task.cancel()
-            try:
-                await self._battle_task
-            except asyncio.CancelledError:
-                pass
-            self._battle_task = None
+        # Cancel battle monitor tasks
+        await self._stop_battle_monitors()
+        await self.stop_position_sampler()
 
         # Clean up clients
         if hasattr(self, 'clients'):
@@ -166,26 +1585,31 @@ class EnhancedWizWalker(ClientHandler):
             print(f"Error in parent close: {e}")
 
         self.clients = []
+        self._speed_cache.clear()
+        self.client_speeds.clear()
+        self.poll_schedulers.clear()
+        self.state_machines.clear()
+        self._objective_cache.clear()
         print("Cleanup complete")
 
-    def start_battle_monitor(self):
-        lock_path = os.path.join(tempfile.gettempdir(), "wizwalker_battle_monitor.lock")
-        if os.path.exists(lock_path):
-            print("Battle monitor is already running.")
-            return
-        with open(lock_path, "w") as f:
-            f.write("locked")
-        bat_path = os.path.join(os.path.dirname(__file__), "battle_monitor.py")
-        cmd = f'start "Battle Monitor" cmd /k python "{bat_path}"'
-        self.monitor_process = subprocess.Popen(cmd, shell=True)
-
-    def stop_battle_monitor(self):
-        lock_path = os.path.join(tempfile.gettempdir(), "wizwalker_battle_monitor.lock")
-        if os.path.exists(lock_path):
+    async def start_battle_monitor(self):
+        """Start publishing battle events; viewers connect with battle_monitor.py"""
+        if not event_broker.running:
             try:
-                os.remove(lock_path)
-            except Exception:
-                pass
+                await event_broker.start()
+            except OSError as e:
+                print(f"Could not start battle event stream on {event_broker.address}: {e}")
+                return
+            print(f"Battle events on {event_broker.address}, watch with: python battle_monitor.py")
+        if self.open_monitor_window and sys.platform == "win32" and self.monitor_process is None:
+            bat_path = os.path.join(os.path.dirname(__file__), "battle_monitor.py")
+            self.monitor_process = subprocess.Popen(
+                [sys.executable, bat_path, "--connect", event_broker.address],
+                creationflags=subprocess.CREATE_NEW_CONSOLE
+            )
+
+    async def stop_battle_monitor(self):
+        await event_broker.stop()
         if getattr(self, "monitor_process", None):
             try:
                 self.monitor_process.terminate()
@@ -193,65 +1617,205 @@ class EnhancedWizWalker(ClientHandler):
                 pass
             self.monitor_process = None
 
-    async def _monitor_battles(self):
-        was_in_battle = False
-        last_state = None
-        last_speed = None
+    def _client_label(self, client) -> str:
+        try:
+            return f"Client {self.clients.index(client) + 1}"
+        except ValueError:
+            return "Client ?"
+
+    def _start_battle_monitors(self) -> int:
+        """Start a monitor task for every client that doesn't have a live one"""
+        started = 0
+        for client in self.clients:
+            task = self._battle_tasks.get(client)
+            if task is None or task.done():
+                task = background_task(self._monitor_client(client))
+                task.add_done_callback(lambda t, c=client: self._on_monitor_done(c, t))
+                self._battle_tasks[client] = task
+                started += 1
+        return started
+
+    async def _stop_battle_monitors(self):
+        tasks = list(self._battle_tasks.values())
+        self._battle_tasks = {}
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _on_monitor_done(self, client, task: asyncio.Task):
+        # Supervisor: restart a monitor that died unexpectedly, leave the others alone
+        if task.cancelled() or self._battle_tasks.get(client) is not task:
+            return
+        error = task.exception()
+        if error is None:
+            return
+        label = self._client_label(client)
+        log_battle_event(f"[{label}] Monitor crashed: {error!r}, restarting", client=label, event="error")
+        del self._battle_tasks[client]
+        if self.running and self.fast_battles_enabled and client in self.clients:
+            self._start_battle_monitors()
+
+    def add_transition_callback(self, callback):
+        """Register an async callback(client, transition) for battle state changes"""
+        if callback not in self._transition_callbacks:
+            self._transition_callbacks.append(callback)
+
+    def remove_transition_callback(self, callback):
+        if callback in self._transition_callbacks:
+            self._transition_callbacks.remove(callback)
+
+    def set_state_debounce(self, confirm_ticks=None, confirm_time=None):
+        if confirm_ticks is not None:
+            self.state_confirm_ticks = confirm_ticks
+        if confirm_time is not None:
+            self.state_confirm_time = confirm_time
+        for machine in self.state_machines.values():
+            machine.confirm_ticks = self.state_confirm_ticks
+            machine.confirm_time = self.state_confirm_time
+
+    def client_speed(self, client) -> float:
+        """Normal (non-animation) speed for a client"""
+        return self.client_speeds.get(client, self.speed_multiplier)
+
+    def _wanted_speed(self, state: str, client=None) -> float:
+        return self.battle_speed_multiplier if state == "playing_animation" else self.client_speed(client)
+
+    def _speed_target(self, client, state: Optional[str]) -> Optional[int]:
+        """Speed (x100) the monitor holds a client at for its confirmed state. Out of battle a
+        speed that was written successfully is left alone, so forcespeed and testspeed stick."""
+        if state is None:
+            return None
+        cached = self._speed_cache.get(client)
+        if state == "not_in_battle" and cached is not None:
+            return cached
+        return int(self._wanted_speed(state, client) * 100)
+
+    async def _dispatch_transition(self, client, transition: StateTransition):
+        for callback in list(self._transition_callbacks):
+            try:
+                await callback(client, transition)
+            except Exception as e:
+                name = getattr(callback, "__name__", repr(callback))
+                log_battle_event(f"[{transition.client}] Transition callback {name} failed: {e}",
+                                 client=transition.client, event="error")
+
+    async def _log_transition(self, client, transition: StateTransition):
+        label = transition.client
+        in_battle = transition.state != "not_in_battle"
+        was_in_battle = transition.previous not in (None, "not_in_battle")
+        if in_battle and not was_in_battle:
+            log_battle_event(f"[{label}] Battle began!", client=label, event="battle_began")
+        elif was_in_battle and not in_battle:
+            log_battle_event(f"[{label}] Battle ended!", client=label, event="battle_ended")
+        event_broker.publish("state", client=label, state=transition.state, previous=transition.previous,
+                             speed=self._wanted_speed(transition.state, client), dwell=round(transition.dwell, 3))
+
+    async def _speed_on_transition(self, client, transition: StateTransition):
+        if transition.state == "playing_animation":
+            phase = "animation phase"
+        elif transition.state == "planning":
+            phase = "planning phase"
+        elif transition.previous is not None:
+            phase = None  # battle ended
+        else:
+            return
+        speed = self._wanted_speed(transition.state, client)
+        if not await self._set_client_speed(client, speed) or phase is None:
+            return
+        scheduler = self.poll_schedulers.get(client)
+        latency = scheduler.record_speed_change(since=transition.since) if scheduler else None
+        log_battle_event(f"[{transition.client}] Set speed to {speed}x ({phase})",
+                         client=transition.client, event="speed", speed=speed,
+                         latency_ms=round(latency * 1000, 1) if latency is not None else None)
+
+    async def _stats_on_transition(self, client, transition: StateTransition):
+        client_stats.transition(transition)
+
+    async def _monitor_client(self, client):
+        label = self._client_label(client)
+        window_cache = WindowCache(client)
+        scheduler = PollScheduler(self.poll_floor, self.poll_ceiling, self.battle_poll_ceiling)
+        self.poll_schedulers[client] = scheduler
+        machine = BattleStateMachine(label, self.state_confirm_ticks, self.state_confirm_time)
+        self.state_machines[client] = machine
+        loop = asyncio.get_running_loop()
+        next_readback = loop.time() + (self.speed_readback_interval or 0)
 
         while self.running and self.fast_battles_enabled:
             try:
-                for client in self.clients:
-                    in_battle = await client.in_battle()
-                    duel_phase = None
-                    try:
-                        duel_phase = await client.duel.duel_phase()
-                    except Exception:
-                        duel_phase = "Unknown"
-                    try:
-                        combat_windows = await client.root_window.get_windows_with_name("CombatantControl")
-                        duel_window = await client.root_window.get_windows_with_name("duelWindow")
-                    except Exception:
-                        combat_windows = []
-                        duel_window = []
-
-                    current_state = await client.detect_battle_state()
-                    speed = self.battle_speed_multiplier if current_state == "playing_animation" else self.speed_multiplier
-
-                    debug_msg = (
-                        f"In Battle: {in_battle}\n"
-                        f"Duel Phase: {duel_phase}\n"
-                        f"Combat windows found: {len(combat_windows)}\n"
-                        f"Duel window found: {len(duel_window) > 0}\n"
-                        f"Battle state detection result: {current_state} (speed: {speed}x{' - is sped up' if current_state == 'playing_animation' else ''})"
+                scheduler.tick_started()
+                snap = await ClientSnapshot.capture(client, window_cache, self.battle_debug)
+                current_state = snap.state
+                speed = self._wanted_speed(current_state, client)
+
+                state_msg = (
+                    f"Battle state detection result: {current_state} (speed: {speed}x"
+                    f"{' - is sped up' if current_state == 'playing_animation' else ''})"
+                )
+                if self.battle_debug:
+                    state_msg = (
+                        f"[{label}] In Battle: {snap.in_battle}\n"
+                        f"Duel Phase: {snap.duel_phase}\n"
+                        f"Combat windows found: {len(snap.combat_windows)}\n"
+                        f"Duel window found: {len(snap.duel_windows) > 0}\n"
+                        f"{state_msg}"
                     )
-                    log_battle_event(debug_msg)
-
-                    if current_state != "not_in_battle":
-                        if not was_in_battle:
-                            log_battle_event("Battle began!")
-                            was_in_battle = True
-
-                        if current_state == "playing_animation":
-                            await self.apply_speed(self.battle_speed_multiplier, client, silent=True)
-                            log_battle_event(f"Set speed to {self.battle_speed_multiplier}x (animation phase)")
-                            last_speed = self.battle_speed_multiplier
-                        elif current_state == "planning":
-                            await self.apply_speed(self.speed_multiplier, client, silent=True)
-                            log_battle_event(f"Set speed to {self.speed_multiplier}x (planning phase)")
-                            last_speed = self.speed_multiplier
-
-                    elif was_in_battle:
-                        log_battle_event("Battle ended!")
-                        was_in_battle = False
-                        await self.apply_speed(self.speed_multiplier, client, silent=True)
-                        last_speed = self.speed_multiplier
-
-                await asyncio.sleep(0.1 if was_in_battle else 0.5)
+                else:
+                    state_msg = f"[{label}] {state_msg}"
+                battle_logger.log_state(label, state_msg, client=label, state=current_state)
+
+                # Speed, logging and stats only react to debounced transitions, not to every read
+                transition = machine.observe(current_state, scheduler.last_poll)
+                if transition is not None:
+                    await self._dispatch_transition(client, transition)
+                    if transition.state == "not_in_battle":
+                        window_cache.invalidate()
+
+                # A failed write empties the cache, so this retries every tick until one lands
+                target = self._speed_target(client, machine.state)
+                if target is not None and self._speed_cache.get(client) != target:
+                    if await self._set_client_speed(client, target / 100):
+                        log_battle_event(f"[{label}] Re-applied {target / 100}x ({machine.state})",
+                                         client=label, event="speed_retry", speed=target / 100)
+
+                if self.speed_readback_interval and loop.time() >= next_readback:
+                    next_readback = loop.time() + self.speed_readback_interval
+                    if await self._reassert_speed(client, target):
+                        log_battle_event(f"[{label}] Speed drifted, re-applied {self._speed_cache[client] / 100}x",
+                                         client=label, event="speed_drift")
+
+                delay = scheduler.observe(current_state, snap.duel_phase)
+                due = loop.time() + delay
+                await asyncio.sleep(delay)
+                client_stats.tick_lateness.record(max(0.0, loop.time() - due))
 
             except Exception as e:
-                log_battle_event(f"Monitor error: {e}")
+                log_battle_event(f"[{label}] Monitor error: {e}", client=label, event="error")
                 await asyncio.sleep(0.2)
 
+    async def quest_objectives(self, client):
+        """(quest_id, objectives), fetching objectives only when quest or goal changed"""
+        quest_id, goal_id = await asyncio.gather(client.quest_id(), client.goal_id())
+        cached = self._objective_cache.get(client)
+        if cached is not None and cached[0] == (quest_id, goal_id):
+            return quest_id, cached[1]
+        objectives = list(await client.get_quest_objectives() or [])
+        self._objective_cache[client] = ((quest_id, goal_id), objectives)
+        return quest_id, objectives
+
+    def start_position_sampler(self, rate: float = 10.0):
+        if self.position_sampler is not None and self.position_sampler.running:
+            return False
+        self.position_sampler = PositionSampler(location_tracker, rate)
+        self.position_sampler.start(self.clients)
+        return True
+
+    async def stop_position_sampler(self):
+        if self.position_sampler is not None:
+            await self.position_sampler.stop()
+            self.position_sampler = None
+
     async def toggle_fast_battles(self, enabled: Optional[bool] = None):
         if enabled is None:
             self.fast_battles_enabled = not self.fast_battles_enabled
@@ -262,29 +1826,57 @@ class EnhancedWizWalker(ClientHandler):
         print(f"\nFast battles {status}")
 
         if self.fast_battles_enabled:
-            self.start_battle_monitor()
-            if not self._battle_task or self._battle_task.done():
-                self._battle_task = asyncio.create_task(self._monitor_battles())
+            await self.start_battle_monitor()
+            self._start_battle_monitors()
         else:
-            if self._battle_task:
-                self._battle_task.cancel()
-            self.stop_battle_monitor()
+            await self._stop_battle_monitors()
+            await self.stop_battle_monitor()
             for client in self.clients:
-                await self.apply_speed(self.speed_multiplier, client)
+                await self.apply_speed(self.client_speed(client), client)
 
-    async def apply_speed(self, speed_value: float, client=None, silent=False):
+    async def _set_client_speed(self, client, speed_value: float, force: bool = False) -> bool:
+        """Write the speed unless it's already the cached value, returns True if a write happened"""
+        target_speed = int(speed_value * 100)
+        if not force and self._speed_cache.get(client) == target_speed:
+            return False
+        client_object = client.client_object
+        try:
+            await client_stats.timed("write_speed_multiplier", client_object.write_speed_multiplier(target_speed))
+        except Exception:
+            # Fall back to a raw write at the known address
+            self._speed_cache.pop(client, None)
+            if not (hasattr(client_object, 'speed_multiplier_address') and hasattr(client_object, 'write_typed')):
+                raise
+            await client_stats.timed(
+                "write_typed", client_object.write_typed(client_object.speed_multiplier_address, target_speed, "int"))
+        self._speed_cache[client] = target_speed
+        client_stats.speed_write()
+        return True
+
+    async def _reassert_speed(self, client, target: Optional[int] = None) -> bool:
+        """Read the game's speed back and rewrite it if it isn't target (x100), by default the cached speed"""
+        target = self._speed_cache.get(client) if target is None else target
+        if target is None:
+            return False
+        try:
+            current = await client_stats.timed("speed_multiplier", client.client_object.speed_multiplier())
+        except Exception:
+            return False
+        if current == target:
+            return False
+        return await self._set_client_speed(client, target / 100, force=True)
+
+    async def apply_speed(self, speed_value: float, client=None, silent=False, force=False):
         try:
-            target_speed = int(speed_value * 100)
             clients_to_update = [client] if client else self.clients
             for c in clients_to_update:
                 try:
-                    await c.client_object.write_speed_multiplier(target_speed)
-                    if hasattr(c.client_object, 'speed_multiplier_address'):
-                        addr = c.client_object.speed_multiplier_address
-                        if hasattr(c.client_object, 'write_typed'):
-                            await c.client_object.write_typed(addr, target_speed, "int")
+                    written = await self._set_client_speed(c, speed_value, force=force)
                     if not silent:
-                        print(f"Applied speed {speed_value}x to client")
+                        if written:
+                            print(f"Applied speed {speed_value}x to client")
+                        else:
+                            print(f"Client already at speed {speed_value}x")
                 except Exception as e:
                     if not silent:
                         print(f"Speed application error: {e}")
@@ -296,14 +1888,463 @@ class EnhancedWizWalker(ClientHandler):
 
     # ... rest of your class (start, close, etc.) ...
 
+def _leg(a, b) -> float:
+    return math.hypot(a.x - b.x, a.y - b.y)
+
+def route_length(start, stops: list) -> float:
+    total = 0.0
+    previous = start
+    for stop in stops:
+        total += _leg(previous, stop)
+        previous = stop
+    return total
+
+def plan_quest_route(start, objectives: list, skip_radius: float = 0.0):
+    """Order objectives for teleporting from start: nearest neighbour, then 2-opt.
+    Objectives within skip_radius of an earlier stop are covered by it and dropped.
+    Returns (route, skipped)."""
+    remaining = list(objectives)
+    route = []
+    skipped = []
+    current = start
+    while remaining:
+        nearest = min(range(len(remaining)), key=lambda idx: _leg(current, remaining[idx]))
+        current = remaining.pop(nearest)
+        route.append(current)
+        if skip_radius > 0:
+            covered = [obj for obj in remaining if _leg(current, obj) <= skip_radius]
+            skipped += covered
+            remaining = [obj for obj in remaining if _leg(current, obj) > skip_radius]
+
+    # 2-opt on the open path; the start is fixed and the end is free
+    points = [start] + route
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(points) - 1):
+            for j in range(i + 1, len(points)):
+                before = _leg(points[i - 1], points[i])
+                after = _leg(points[i - 1], points[j])
+                if j + 1 < len(points):
+                    before += _leg(points[j], points[j + 1])
+                    after += _leg(points[i], points[j + 1])
+                if after < before - 1e-9:
+                    points[i:j + 1] = reversed(points[i:j + 1])
+                    improved = True
+    return points[1:], skipped
+
+# How long a command may hold the prompt before it's moved to the background
+COMMAND_FOREGROUND_TIMEOUT = 1.0
+# Commands that read the keyboard themselves and keep the prompt until they finish
+FOREGROUND_COMMANDS = {"watch"}
+
 def restart_script():
     print("\nRestarting script...")
     subprocess.Popen([sys.executable, sys.argv[0]])
     sys.exit(0)
 
+# Commands that act on a single client and can be sent to several with @selectors
+CLIENT_COMMANDS = {"info", "teleport", "goto", "gotoquest", "quest", "speed", "forcespeed", "testspeed"}
+
+_task_output: contextvars.ContextVar = contextvars.ContextVar("task_output", default=None)
+
+class TaskLocalStdout:
+    """stdout wrapper that sends a task's prints to its own buffer when one is set,
+    so concurrent per-client commands don't interleave their output"""
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        buffer = _task_output.get()
+        if buffer is not None:
+            return buffer.write(text)
+        return self._stream.write(text)
+
+    def flush(self):
+        if _task_output.get() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+def parse_client_selector(selector: str, clients: list) -> list:
+    """'@all' or '@1,3' -> the selected clients, numbered from 1"""
+    spec = selector[1:]
+    if spec == "all":
+        return list(clients)
+    selected = []
+    for part in spec.split(","):
+        index = int(part)
+        if not 1 <= index <= len(clients):
+            raise ValueError(f"no client {index}, {len(clients)} connected")
+        if clients[index - 1] not in selected:
+            selected.append(clients[index - 1])
+    return selected
+
+async def run_on_clients(walker, clients: list, cmd, args):
+    """Run one command on several clients at once and print each client's output together"""
+    async def run_one(target):
+        buffer = io.StringIO()
+        _task_output.set(buffer)
+        started = time.perf_counter()
+        error = None
+        try:
+            await run_command(walker, target, cmd, args, selected=True)
+        except Exception as e:
+            error = e
+        return buffer.getvalue(), error, time.perf_counter() - started
+
+    # gather wraps each coroutine in its own task, so each gets its own output buffer
+    results = await asyncio.gather(*(run_one(target) for target in clients))
+    for target, (output, error, elapsed) in zip(clients, results):
+        print(f"\n##### {walker._client_label(target)} ({elapsed:.2f}s) #####")
+        if output.strip():
+            print(output.strip("\n"))
+        if error is not None:
+            print(f"Command error: {error}")
+
+async def ainput(prompt: str = "") -> str:
+    """input() that waits in a daemon thread so the event loop keeps running"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def deliver(result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def reader():
+        try:
+            line = input(prompt)
+        except BaseException as e:
+            result, error = None, e
+        else:
+            result, error = line, None
+        try:
+            loop.call_soon_threadsafe(deliver, result, error)
+        except RuntimeError:
+            pass  # loop already closed
+
+    threading.Thread(target=reader, name="wizwalker-input", daemon=True).start()
+    return await future
+
+async def run_command(walker, client, cmd, args, selected: bool = False):
+    """selected: run for one client of an @ selector, so settings apply to that client only"""
+    if cmd == "help":
+        print("\nAvailable Commands:")
+        print("- info: Show detailed client info (status, quests, etc.)")
+        print("- watch [interval]: Keep the client info refreshing until Enter is pressed")
+        print("- teleport/goto x y z: Teleport to coordinates")
+        print("- gotoquest [dry] [radius]: Teleport through quest objectives on a planned route")
+        print("- quest: Show quest info")
+        print("- speed x: Set speed multiplier for every client (@N speed x: just those clients)")
+        print("- fastbattles/fb [on|off]: Toggle fast battle animations")
+        print("- battlespeed/bs [speed]: Set battle animation speed")
+        print("- battledebug [on|off]: Log combat/duel window counts with each battle state")
+        print("- sample [on [rate]|off]: Record positions of all clients into the location map")
+        print("- forcespeed x: Force specific game speed")
+        print("- latency: Show battle transition to speed change latency")
+        print("- debounce [ticks] [seconds]: Reads needed before a battle state change is accepted")
+        print("- stats [reset|export <path> [interval]|export off]: Client call timings")
+        print("- @all <command> / @1,3 <command>: Run a client command on several clients")
+        print("- jobs: List commands still running in the background")
+        print("- cancel <id|all>: Cancel background commands")
+        print("- restart: Restart the script")
+        print("- exit: Exit program")
+    elif cmd == "info":
+        if client:
+            try:
+                snap = await InfoSnapshot.capture(client)
+                print(snap.format(walker.client_speed(client)))
+            except Exception as e:
+                print(f"Error getting client info: {e}")
+        else:
+            print("No client connected")
+    elif cmd == "watch":
+        if not client:
+            print("No client connected")
+            return
+        try:
+            interval = float(args[0]) if args else 1.0
+        except ValueError:
+            print("Usage: watch [interval]")
+            return
+        if sys.platform == "win32":
+            os.system("")  # turns on ANSI escape handling in the Windows console
+        snap = None
+        # main() keeps watch in the foreground, so this is the only reader of stdin until it returns
+        stop = asyncio.ensure_future(ainput())
+        while not stop.done():
+            try:
+                snap = await InfoSnapshot.capture(client, snap)
+                text = snap.format(walker.client_speed(client))
+            except Exception as e:
+                text = f"Error getting client info: {e}"
+            # Clear and redraw from the top so stray output can't leave stale lines behind
+            print("\x1b[H\x1b[2J" + text + f"\n\n(refreshing every {interval}s, press Enter to stop)", flush=True)
+            await asyncio.wait({stop}, timeout=interval)
+    elif cmd == "speed":
+        if client and args:
+            try:
+                speed = float(args[0])
+            except ValueError:
+                print("Invalid speed value")
+                return
+            if selected:
+                walker.client_speeds[client] = speed
+            else:
+                walker.speed_multiplier = speed
+                walker.client_speeds.clear()
+            await walker.apply_speed(speed, client)
+        else:
+            print(f"Current speed: {walker.client_speed(client)}x")
+            print("Usage: speed <multiplier>")
+    elif cmd in ["teleport", "goto"]:
+        if not client or len(args) < 2:
+            print("Usage: goto x y [z]")
+            return
+        try:
+            x, y = float(args[0]), float(args[1])
+            z = float(args[2]) if len(args) > 2 else 0.0
+            await client.teleport(XYZ(x, y, z))
+        except ValueError:
+            print("Invalid coordinates")
+    elif cmd == "gotoquest":
+        if client:
+            dry_run = "dry" in args
+            try:
+                radius = float(next(arg for arg in args if arg != "dry"))
+            except StopIteration:
+                radius = walker.route_skip_radius
+            except ValueError:
+                print("Usage: gotoquest [dry] [skip radius]")
+                return
+            _, objectives = await walker.quest_objectives(client)
+            if objectives:
+                start = await client.body.position()
+                route, skipped = plan_quest_route(start, objectives, radius)
+                if dry_run:
+                    print(f"\nPlanned route ({len(route)} stops, {len(skipped)} covered within {radius:.0f} units):")
+                    previous = start
+                    for idx, stop in enumerate(route, 1):
+                        print(f"  {idx}. <{stop.x:.1f}, {stop.y:.1f}, {stop.z:.1f}>  +{_leg(previous, stop):.1f}")
+                        previous = stop
+                    # Compare orderings over the same stops, skipping is reported on its own
+                    kept = {id(stop) for stop in route}
+                    planned = route_length(start, route)
+                    naive = route_length(start, [obj for obj in objectives if id(obj) in kept])
+                    saved = naive - planned
+                    percent = saved / naive * 100 if naive else 0.0
+                    print(f"Distance: {planned:.1f} vs {naive:.1f} in quest order (saves {saved:.1f}, {percent:.0f}%)")
+                    if skipped:
+                        print(f"Skipped (within {radius:.0f} units of a stop): "
+                              + ", ".join(f"<{obj.x:.1f}, {obj.y:.1f}, {obj.z:.1f}>" for obj in skipped))
+                        print(f"All {len(objectives)} objectives in quest order: {route_length(start, objectives):.1f}")
+                else:
+                    for obj in route:
+                        await client.teleport(obj)
+                        print(f"Teleported to {obj}")
+            else:
+                print("No quest objectives found")
+    elif cmd == "quest":
+        if client:
+            try:
+                quest_id, objectives = await walker.quest_objectives(client)
+                current_pos, current_zone = await asyncio.gather(client.body.position(), client.zone_name())
+                location_tracker.update_location(
+                    current_zone,
+                    current_pos.x,
+                    current_pos.y,
+                    current_pos.z
+                )
+                print("\nQuest Information:")
+                print(f"ID: {quest_id}")
+                if objectives:
+                    print("\nObjectives:")
+                    for idx, obj in enumerate(objectives, 1):
+                        try:
+                            distance = _leg(obj, current_pos)
+                            loc_info = location_tracker.get_location_info(
+                                current_zone,
+                                obj.x,
+                                obj.y,
+                                obj.z
+                            )
+                            print(f"\nObjective {idx}:")
+                            print(f"  Zone: {current_zone}")
+                            print(f"  Area: {loc_info['area']}")
+                            if loc_info['landmark']:
+                                print(f"  Near: {loc_info['landmark']}")
+                            print(f"  Position: <{obj.x:.1f}, {obj.y:.1f}, {obj.z:.1f}>")
+                            print(f"  Distance: {distance:.1f} units")
+                            dx = obj.x - current_pos.x
+                            dy = obj.y - current_pos.y
+                            direction = ""
+                            if abs(dx) > abs(dy) * 2:
+                                direction = "East" if dx > 0 else "West"
+                            elif abs(dy) > abs(dx) * 2:
+                                direction = "North" if dy > 0 else "South"
+                            else:
+                                ns = "North" if dy > 0 else "South"
+                                ew = "East" if dx > 0 else "West"
+                                direction = f"{ns}-{ew}"
+                            print(f"  Direction: {direction}")
+                        except Exception as e:
+                            print(f"Error displaying objective {idx}: {e}")
+                else:
+                    print("\nNo quest objectives found")
+            except Exception as e:
+                print(f"Error getting quest details: {e}")
+    elif cmd in ["fastbattles", "fb"]:
+        if args:
+            enabled = args[0].lower() == "on"
+            await walker.toggle_fast_battles(enabled)
+        else:
+            await walker.toggle_fast_battles()
+    elif cmd in ["battlespeed", "bs"]:
+        if args:
+            try:
+                speed = float(args[0])
+                if speed >= 1.0:
+                    walker.battle_speed_multiplier = speed
+                    print(f"Battle animation speed set to {speed}x")
+                else:
+                    print("Speed must be 1.0 or higher")
+            except ValueError:
+                print("Invalid speed value")
+        else:
+            print(f"Current battle animation speed: {walker.battle_speed_multiplier}x")
+            print("Usage: battlespeed <speed>")
+    elif cmd == "forcespeed":
+        if client and args:
+            try:
+                speed = float(args[0])
+                print(f"Forcing client speed to {speed}x")
+                await walker._set_client_speed(client, speed, force=True)
+            except Exception as e:
+                print(f"Error setting forced speed: {e}")
+        else:
+            print("Usage: forcespeed <multiplier>")
+    elif cmd == "startbm":
+        if walker.fast_battles_enabled:
+            await walker.start_battle_monitor()
+            started = walker._start_battle_monitors()
+            if started:
+                print(f"Battle monitor manually started for {started} client(s)")
+            else:
+                print("Battle monitor is already running")
+        else:
+            print("Enable fast battles first with 'fb on'")
+    elif cmd == "sample":
+        sampler = walker.position_sampler
+        if not args:
+            if sampler is not None and sampler.running:
+                print(f"Sampling at {sampler.rate} Hz: {sampler.samples} samples, {sampler.dropped} dropped")
+            else:
+                print("Position sampler is off")
+        elif args[0] == "on":
+            try:
+                rate = float(args[1]) if len(args) > 1 else 10.0
+            except ValueError:
+                print("Invalid rate")
+                return
+            if walker.start_position_sampler(rate):
+                print(f"Sampling positions at {rate} Hz")
+            else:
+                print("Position sampler is already running")
+        elif args[0] == "off":
+            await walker.stop_position_sampler()
+            print("Position sampler stopped")
+        else:
+            print("Usage: sample [on [rate]|off]")
+    elif cmd == "latency":
+        if not walker.poll_schedulers:
+            print("Battle monitor hasn't run yet, enable it with 'fb on'")
+        for monitored, scheduler in walker.poll_schedulers.items():
+            summary = scheduler.latency_summary()
+            label = walker._client_label(monitored)
+            if summary is None:
+                print(f"{label}: no speed changes yet (polling every {scheduler.interval * 1000:.0f} ms)")
+            else:
+                print(
+                    f"{label}: {summary['count']} changes, p50 {summary['p50'] * 1000:.0f} ms, "
+                    f"p90 {summary['p90'] * 1000:.0f} ms, max {summary['max'] * 1000:.0f} ms"
+                )
+    elif cmd == "battledebug":
+        if args and args[0] in ("on", "off"):
+            walker.battle_debug = args[0] == "on"
+        elif not args:
+            walker.battle_debug = not walker.battle_debug
+        else:
+            print("Usage: battledebug [on|off]")
+            return
+        print(f"Battle debug logging {'enabled' if walker.battle_debug else 'disabled'}")
+    elif cmd == "debounce":
+        if args:
+            try:
+                walker.set_state_debounce(int(args[0]), float(args[1]) if len(args) > 1 else None)
+            except ValueError:
+                print("Usage: debounce [ticks] [seconds]")
+                return
+        print(f"State changes need {walker.state_confirm_ticks} consecutive reads "
+              f"held for {walker.state_confirm_time}s")
+        for monitored, machine in walker.state_machines.items():
+            print(f"{walker._client_label(monitored)}: {machine.state}, {machine.rejected} flickers ignored")
+    elif cmd == "stats":
+        if not args:
+            print(client_stats.report())
+        elif args[0] == "reset":
+            client_stats.reset()
+            print("Stats reset")
+        elif args[0] == "export" and len(args) > 1 and args[1] == "off":
+            client_stats.stop_export()
+            print("Stats export stopped")
+        elif args[0] == "export" and len(args) > 1:
+            try:
+                interval = float(args[2]) if len(args) > 2 else 15.0
+            except ValueError:
+                print("Invalid interval")
+                return
+            client_stats.start_export(args[1], interval)
+            print(f"Writing Prometheus stats to {args[1]} every {interval}s")
+        else:
+            print("Usage: stats [reset|export <path> [interval]|export off]")
+    elif cmd == "testspeed":
+        if client and args:
+            try:
+                speed = float(args[0])
+                print(f"Testing direct speed write: {speed}x")
+                await walker.apply_speed(speed, client, force=True)
+            except Exception as e:
+                print(f"Error in direct speed test: {e}")
+        else:
+            print("Usage: testspeed <multiplier>")
+
+
 async def main():
     walker = None
+    # job id -> [command, task, backgrounded]
+    jobs: Dict[int, list] = {}
+    job_ids = itertools.count(1)
+
+    def on_job_done(job_id, task):
+        command, _, background = jobs.pop(job_id, (None, None, False))
+        if task.cancelled():
+            if background:
+                print(f"\n[job {job_id}] {command} cancelled")
+            return
+        if task.exception() is not None:
+            print(f"\nCommand error: {task.exception()}")
+        elif background:
+            print(f"\n[job {job_id}] {command} finished")
+
+    real_stdout = sys.stdout
+    sys.stdout = TaskLocalStdout(real_stdout)
     try:
+        await location_tracker.open()
         walker = EnhancedWizWalker(2.0)
         print("\nConnecting to Wizard101...")
         if not await walker.start():
@@ -314,196 +2355,85 @@ async def main():
 
         while walker.running:
             try:
-                command = input("\nWizWalker> ").strip().lower()
+                try:
+                    command = (await ainput("\nWizWalker> ")).strip().lower()
+                except EOFError:
+                    command = "exit"
                 parts = command.split()
+                targets = None
+                if parts and parts[0].startswith("@"):
+                    try:
+                        targets = parse_client_selector(parts[0], walker.clients)
+                    except ValueError as e:
+                        print(f"Invalid client selector {parts[0]}: {e}")
+                        continue
+                    parts = parts[1:]
                 if not parts:
                     continue
                 cmd = parts[0]
                 args = parts[1:]
+                if targets is not None and cmd not in CLIENT_COMMANDS:
+                    print(f"'{cmd}' doesn't take a client selector, running it once")
+                    targets = None
 
                 if cmd == "exit":
                     walker.running = False
-                elif cmd == "help":
-                    print("\nAvailable Commands:")
-                    print("- info: Show detailed client info (status, quests, etc.)")
-                    print("- teleport/goto x y z: Teleport to coordinates")
-                    print("- gotoquest: Teleport to quest objective")
-                    print("- quest: Show quest info")
-                    print("- speed x: Set speed multiplier")
-                    print("- fastbattles/fb [on|off]: Toggle fast battle animations")
-                    print("- battlespeed/bs [speed]: Set battle animation speed")
-                    print("- battledebug: Debug battle detection")
-                    print("- forcespeed x: Force specific game speed")
-                    print("- restart: Restart the script")
-                    print("- exit: Exit program")
-                elif cmd == "info":
-                    if client:
-                        try:
-                            zone = await client.zone_name()
-                            pos = await client.body.position()
-                            in_battle = await client.in_battle()
-                            in_dialog = await client.is_in_dialog()
-                            in_npc_range = await client.is_in_npc_range()
-                            is_loading = await client.is_loading()
-                            quest_id = await client.quest_id()
-                            goal_id = await client.goal_id()
-                            print("\n=== Client Information ===")
-                            print(f"Zone: {zone}")
-                            print(f"Position: {pos}")
-                            print(f"Loading: {is_loading}")
-                            print(f"Speed: {walker.speed_multiplier}x")
-                            print("\n=== Status ===")
-                            print(f"In Battle: {in_battle}")
-                            print(f"In Dialog: {in_dialog}")
-                            print(f"In NPC Range: {in_npc_range}")
-                            print("\n=== Quest ===")
-                            print(f"Quest ID: {quest_id}")
-                            print(f"Goal ID: {goal_id}")
-                            if in_battle:
-                                try:
-                                    duel_phase = await client.duel.duel_phase()
-                                    print(f"Duel Phase: {duel_phase}")
-                                except:
-                                    print("Duel details unavailable")
-                        except Exception as e:
-                            print(f"Error getting client info: {e}")
-                    else:
-                        print("No client connected")
-                elif cmd in ["teleport", "goto"]:
-                    if not client or len(args) < 2:
-                        print("Usage: goto x y [z]")
-                        continue
-                    try:
-                        x, y = float(args[0]), float(args[1])
-                        z = float(args[2]) if len(args) > 2 else 0.0
-                        await client.teleport(XYZ(x, y, z))
-                    except ValueError:
-                        print("Invalid coordinates")
-                elif cmd == "gotoquest":
-                    if client:
-                        objectives = await client.get_quest_objectives()
-                        if objectives:
-                            for obj in objectives:
-                                await client.teleport(obj)
-                                print(f"Teleported to {obj}")
-                        else:
-                            print("No quest objectives found")
-                elif cmd == "quest":
-                    if client:
-                        try:
-                            quest_id = await client.quest_id()
-                            objectives = await client.get_quest_objectives()
-                            current_pos = await client.body.position()
-                            current_zone = await client.zone_name()
-                            location_tracker.update_location(
-                                current_zone,
-                                current_pos.x,
-                                current_pos.y,
-                                current_pos.z
-                            )
-                            print("\nQuest Information:")
-                            print(f"ID: {quest_id}")
-                            if objectives:
-                                print("\nObjectives:")
-                                for idx, obj in enumerate(objectives, 1):
-                                    try:
-                                        distance = math.sqrt(
-                                            (obj.x - current_pos.x) ** 2 +
-                                            (obj.y - current_pos.y) ** 2
-                                        )
-                                        loc_info = location_tracker.get_location_info(
-                                            current_zone,
-                                            obj.x,
-                                            obj.y,
-                                            obj.z
-                                        )
-                                        print(f"\nObjective {idx}:")
-                                        print(f"  Zone: {current_zone}")
-                                        print(f"  Area: {loc_info['area']}")
-                                        if loc_info['landmark']:
-                                            print(f"  Near: {loc_info['landmark']}")
-                                        print(f"  Position: <{obj.x:.1f}, {obj.y:.1f}, {obj.z:.1f}>")
-                                        print(f"  Distance: {distance:.1f} units")
-                                        dx = obj.x - current_pos.x
-                                        dy = obj.y - current_pos.y
-                                        direction = ""
-                                        if abs(dx) > abs(dy) * 2:
-                                            direction = "East" if dx > 0 else "West"
-                                        elif abs(dy) > abs(dx) * 2:
-                                            direction = "North" if dy > 0 else "South"
-                                        else:
-                                            ns = "North" if dy > 0 else "South"
-                                            ew = "East" if dx > 0 else "West"
-                                            direction = f"{ns}-{ew}"
-                                        print(f"  Direction: {direction}")
-                                    except Exception as e:
-                                        print(f"Error displaying objective {idx}: {e}")
-                            else:
-                                print("\nNo quest objectives found")
-                        except Exception as e:
-                            print(f"Error getting quest details: {e}")
-                elif cmd in ["fastbattles", "fb"]:
-                    if args:
-                        enabled = args[0].lower() == "on"
-                        await walker.toggle_fast_battles(enabled)
-                    else:
-                        await walker.toggle_fast_battles()
-                elif cmd in ["battlespeed", "bs"]:
-                    if args:
-                        try:
-                            speed = float(args[0])
-                            if speed >= 1.0:
-                                walker.battle_speed_multiplier = speed
-                                print(f"Battle animation speed set to {speed}x")
-                            else:
-                                print("Speed must be 1.0 or higher")
-                        except ValueError:
-                            print("Invalid speed value")
-                    else:
-                        print(f"Current battle animation speed: {walker.battle_speed_multiplier}x")
-                        print("Usage: battlespeed <speed>")
-                elif cmd == "forcespeed":
-                    if client and args:
-                        try:
-                            speed = float(args[0])
-                            print(f"Forcing client speed to {speed}x")
-                            await client.client_object.write_speed_multiplier(int(speed * 100))
-                        except Exception as e:
-                            print(f"Error setting forced speed: {e}")
-                    else:
-                        print("Usage: forcespeed <multiplier>")
                 elif cmd == "restart":
                     print("Performing full script restart")
+                    for _, task, _ in list(jobs.values()):
+                        task.cancel()
                     if walker:
                         await walker.close()
+                        await walker.stop_battle_monitor()
+                    await location_tracker.close()
+                    await battle_logger.close()
                     restart_script()
-                elif cmd == "startbm":
-                    if walker.fast_battles_enabled:
-                        if walker._battle_task and not walker._battle_task.done():
-                            print("Battle monitor is already running")
-                        else:
-                            walker._battle_task = asyncio.create_task(walker._monitor_battles())
-                            print("Battle monitor manually started")
+                elif cmd == "jobs":
+                    if not jobs:
+                        print("No background commands running")
+                    for job_id, (job_command, _, _) in jobs.items():
+                        print(f"[job {job_id}] {job_command}")
+                elif cmd == "cancel":
+                    if not args:
+                        print("Usage: cancel <id|all>")
+                    elif args[0] == "all":
+                        for _, task, _ in list(jobs.values()):
+                            task.cancel()
                     else:
-                        print("Enable fast battles first with 'fb on'")
-                elif cmd == "testspeed":
-                    if client and args:
                         try:
-                            speed = float(args[0])
-                            print(f"Testing direct speed write: {speed}x")
-                            await walker.apply_speed(speed, client)
-                        except Exception as e:
-                            print(f"Error in direct speed test: {e}")
+                            jobs[int(args[0])][1].cancel()
+                        except (ValueError, KeyError):
+                            print(f"No such job: {args[0]}")
+                else:
+                    # Commands run as tasks; anything slower than the foreground
+                    # timeout keeps going in the background while the prompt returns
+                    job_id = next(job_ids)
+                    if targets is not None:
+                        task = asyncio.create_task(run_on_clients(walker, targets, cmd, args))
                     else:
-                        print("Usage: testspeed <multiplier>")
+                        task = asyncio.create_task(run_command(walker, client, cmd, args))
+                    jobs[job_id] = [command, task, False]
+                    task.add_done_callback(lambda t, j=job_id: on_job_done(j, t))
+                    timeout = None if cmd in FOREGROUND_COMMANDS else COMMAND_FOREGROUND_TIMEOUT
+                    done, _ = await asyncio.wait({task}, timeout=timeout)
+                    if not done:
+                        jobs[job_id][2] = True
+                        print(f"[job {job_id}] {command} running in background")
             except Exception as e:
                 print(f"Command error: {e}")
     except Exception as e:
         print(f"Main error: {e}")
     finally:
+        for _, task, _ in list(jobs.values()):
+            task.cancel()
         if walker:
             await walker.close()
+            await walker.stop_battle_monitor()
+        client_stats.stop_export()
+        await location_tracker.close()
+        await battle_logger.close()
         print("Goodbye!")
+        sys.stdout = real_stdout
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file